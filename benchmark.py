@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+__author__ = 'mattmckay'
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import timeit
+
+from roulette import BinBuilder, Martingale, Passenger57, RouletteGame, SevenReds, Simulator, Table, Wheel, \
+    WheelLayout
+
+
+PLAYERS = (Martingale, SevenReds, Passenger57)
+
+
+def autorange(step, min_seconds, setup=None):
+    """
+    calls STEP in loops of 1, 2, 4... calls, as timeit autoranges, until a loop takes MIN_SECONDS and returns the
+    seconds per call of that loop. SETUP is called untimed before every loop
+    """
+    number = 1
+    while True:
+        if setup is not None:
+            setup()
+        start = timeit.default_timer()
+        for i in xrange(number):
+            step()
+        seconds = timeit.default_timer() - start
+        if seconds >= min_seconds:
+            return seconds / number
+        number *= 2
+
+
+class Benchmark(object):
+    """
+    Benchmark measures the throughput of RouletteGame.cycle, Simulator.session and Simulator.gather for each of the
+    built-in players over a matrix of stake, table limit and rounds, plus the time BinBuilder.build_bins takes.
+    Every case runs in a process of its own so its peak memory can be read from the process' resource usage.
+    Each timing repeats what it times in a loop long enough to take MIN_SECONDS, so timer resolution and one-off
+    stalls don't decide it.
+    The whole matrix is run REPEAT times and each case keeps its best timings. Passes are interleaved rather than
+    back to back, so a stretch of time when the machine is busy slows every case once instead of one case every time.
+    """
+    def __init__(self, stakes, limits, rounds, min_seconds=0.2, samples=50, seed=1, repeat=5):
+        self.stakes = stakes
+        self.limits = limits
+        self.rounds = rounds
+        self.min_seconds = min_seconds # shortest timed loop
+        self.samples = samples # samples gathered per case
+        self.seed = seed
+        self.repeat = repeat
+
+    def run(self):
+        cases = list( (player_class, {"player": player_class.__name__, "stake": stake, "limit": limit,
+                                      "rounds": rounds})
+                      for player_class in PLAYERS for stake in self.stakes for limit in self.limits
+                      for rounds in self.rounds )
+        build_bins = []
+        for attempt in range(self.repeat):
+            build_bins.append(self.time_build_bins()["seconds"])
+            for player_class, case in cases:
+                result = self.run_in_process(player_class, case["stake"], case["limit"], case["rounds"])
+                if attempt == 0:
+                    case.update(result)
+                    continue
+                for metric in ("spins_per_second", "sessions_per_second", "peak_memory_kb"):
+                    case[metric] = max(case[metric], result[metric])
+                case["gather_seconds"] = min(case["gather_seconds"], result["gather_seconds"])
+        return {"build_bins": {"seconds": min(build_bins)}, "cases": list( case for player_class, case in cases )}
+
+    def time_build_bins(self):
+        """
+        times compiling the American layout and building a wheel from it. build_bins() itself would be served the
+        compiled layout from WheelLayout's cache after its first call
+        """
+        build = lambda: WheelLayout.from_pairs("american", 38, BinBuilder().american_outcomes()).build(Wheel())
+        return {"seconds": autorange(build, self.min_seconds)}
+
+    def run_in_process(self, player_class, stake, limit, rounds):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=self.measure, args=(queue, player_class, stake, limit, rounds))
+        process.start()
+        result = queue.get()
+        process.join()
+        return result
+
+    def make_simulator(self, player_class, stake, limit, rounds):
+        wheel = Wheel(random.Random(self.seed))
+        BinBuilder().build_bins(wheel)
+        table = Table(limit=limit)
+        sim = Simulator(RouletteGame(wheel, table), player_class(table=table, stake=stake, rounds_to_go=rounds))
+        sim.init_stake = stake
+        sim.init_duration = rounds
+        return sim
+
+    def measure(self, queue, player_class, stake, limit, rounds):
+        sim = self.make_simulator(player_class, stake, limit, rounds)
+        player, game = sim.player, sim.game
+
+        def restart():
+            # every loop plays the same spins, the longer ones more of them
+            game.wheel.seed(self.seed)
+            sim.reset_player()
+
+        def cycle():
+            if player.rounds_to_go == 0 or player.stake == 0:
+                sim.reset_player()
+            game.cycle(player)
+        cycle_seconds = autorange(cycle, self.min_seconds, restart)
+
+        def session():
+            sim.reset_player()
+            sim.session()
+        session_seconds = autorange(session, self.min_seconds, restart)
+
+        sim.samples = self.samples
+        stdout, sys.stdout = sys.stdout, open(os.devnull, "w") # gather prints its report
+        try:
+            gather_seconds = autorange(sim.gather, self.min_seconds)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        queue.put({
+            "spins_per_second": 1 / cycle_seconds,
+            "sessions_per_second": 1 / session_seconds,
+            "gather_seconds": gather_seconds,
+            "peak_memory_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+
+
+def compare(results, baseline, tolerance):
+    """
+    returns a description of every throughput in RESULTS that fell more than TOLERANCE (a fraction) below BASELINE
+    """
+    key = lambda case: (case["player"], case["stake"], case["limit"], case["rounds"])
+    previous = dict( (key(case), case) for case in baseline["cases"] )
+    regressions = []
+    for case in results["cases"]:
+        old = previous.get(key(case))
+        if old is None:
+            continue
+        for metric in ("spins_per_second", "sessions_per_second"):
+            if case[metric] < old[metric] * (1 - tolerance):
+                regressions.append("%s stake=%d limit=%d rounds=%d: %s %.1f -> %.1f" %
+                                   (key(case) + (metric, old[metric], case[metric])))
+    if results["build_bins"]["seconds"] > baseline["build_bins"]["seconds"] * (1 + tolerance):
+        regressions.append("build_bins: seconds %.6f -> %.6f" %
+                           (baseline["build_bins"]["seconds"], results["build_bins"]["seconds"]))
+    return regressions
+
+
+class RunBenchmark(object):
+    def __init__(self):
+        parser = argparse.ArgumentParser(description='This program benchmarks the Roulette simulation')
+        parser.add_argument('-s', '--stake', help='Initial player stakes', nargs='+', default=[100, 1000], type=int)
+        parser.add_argument('-l', '--limit', help='Table bet limits', nargs='+', default=[100, 1000], type=int)
+        parser.add_argument('-r', '--rounds', help='Rounds per session', nargs='+', default=[250], type=int)
+        parser.add_argument('-o', '--output', help='File the results are saved to as JSON', default=None)
+        parser.add_argument('-b', '--baseline', help='Baseline JSON to compare against, written if missing',
+                            default=None)
+        parser.add_argument('-n', '--repeat', help='Passes over the matrix, each case keeps its best timings',
+                            default=5, type=int)
+        parser.add_argument('-t', '--tolerance', help='Allowed slowdown against the baseline', default=0.1,
+                            type=float)
+        parser.add_argument('-m', '--min-seconds', help='Shortest timed loop, in seconds', default=0.2, type=float)
+        args = parser.parse_args()
+
+        results = Benchmark(args.stake, args.limit, args.rounds, args.min_seconds, repeat=args.repeat).run()
+        for case in results["cases"]:
+            print '%(player)s stake=%(stake)d limit=%(limit)d rounds=%(rounds)d: %(spins_per_second).0f spins/s, ' \
+                  '%(sessions_per_second).1f sessions/s, gather %(gather_seconds).3fs, %(peak_memory_kb)d KB' % case
+        print 'build_bins: %.6fs' % results["build_bins"]["seconds"]
+
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if args.baseline is not None:
+            if not os.path.exists(args.baseline):
+                with open(args.baseline, "w") as f:
+                    json.dump(results, f, indent=2, sort_keys=True)
+                print 'Baseline saved to %s' % args.baseline
+                return
+            with open(args.baseline) as f:
+                regressions = compare(results, json.load(f), args.tolerance)
+            for regression in regressions:
+                print 'REGRESSION %s' % regression
+            if regressions:
+                sys.exit(1)
+
+if __name__ == '__main__':
+    RunBenchmark()
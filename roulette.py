@@ -2,28 +2,75 @@
 __author__ = 'mattmckay'
 
 import argparse
+import ast
+import bisect
+import collections
+import cPickle
+import hashlib
+import importlib
+import itertools
+import json
+import marshal
 import math
+import multiprocessing
+import os
 import random
+import struct
+import tempfile
+import time
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class Outcome(object):
     """
     In Roulette, each spin of the wheel has a number of Outcomes with bets that will be paid off.
     It is important that we establish hash equality and name equality. E.g. must be only a single ("Black" 1:1)
+    Outcomes are immutable. Outcome.intern() hands out the single canonical instance for each name.
     """
+    __slots__ = ('name', 'odds')
+    _registry = {} # name : canonical Outcome
+
     def __init__(self, name, odds):
-        self.name = str(name)
-        self.odds = int(odds)
+        object.__setattr__(self, 'name', str(name))
+        object.__setattr__(self, 'odds', int(odds))
+
+    @classmethod
+    def intern(cls, name, odds):
+        """
+        returns the canonical OUTCOME with the given name, creating it on first use
+        """
+        outcome = cls._registry.get(name)
+        if outcome is None:
+            outcome = cls._registry[name] = cls(name, odds)
+        elif outcome.odds != int(odds):
+            raise ValueError("Outcome %s already exists with odds %d:1" % (outcome.name, outcome.odds))
+        return outcome
 
     def win_amount(self, amount):
         return self.odds * amount
 
+    def __setattr__(self, name, value):
+        raise AttributeError("Outcome is immutable")
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return Outcome, (self.name, self.odds)
+
     def __eq__(self, other):
         return self.name == other.name
 
     def __ne__(self, other):
         return self.name != other.name
 
+    def __hash__(self):
+        return hash(self.name)
+
     def __str__(self):
         return "%s (%d:1)" % ( self.name, self.odds )
 
@@ -31,13 +78,20 @@ class Outcome(object):
 class Bin(object):
     """
     Bin contains a collection of OUTCOMEs which reflect the winning bets that are paid for a particular bin on a
-    roulette wheel.
+    roulette wheel. OUTCOMEs are collected in a set while the wheel is built, then frozen once.
     """
+    __slots__ = ('outcomes',)
+
     def __init__(self, *outcomes):
-        self.outcomes = frozenset([outcomes])
+        self.outcomes = set(outcomes)
 
     def add(self, outcome):
-        self.outcomes |= frozenset([outcome])
+        if isinstance(self.outcomes, frozenset):
+            raise TypeError("Bin is frozen")
+        self.outcomes.add(outcome)
+
+    def freeze(self):
+        self.outcomes = frozenset(self.outcomes)
 
     def __str__(self):
         return ', '.join( map(str,self.outcomes) )
@@ -47,15 +101,31 @@ class Wheel(object):
     """
     Wheel contains the 38 individual bins on the Roulette wheel, plus a random number generator. It can select a Bin at
     random, simulating a spin of a roulette wheel.
+    Given a generator BACKEND, the wheel prefetches spins from it in blocks of BLOCK_SIZE and serves next() from
+    that buffer; otherwise each spin is a choice() on RNG.
     """
-    def __init__(self, rng=None):
+    def __init__(self, rng=None, backend=None, block_size=4096):
         if rng == None:
             self.rng = random.Random()
         else:
             self.rng = rng
-
-        self.bins = tuple( Bin() for i in range(38) )
-        self.all_outcomes = frozenset()
+        self.backend = backend
+        self.block_size = block_size
+        self.buffer = [] # prefetched bin numbers
+        self.position = 0 # index of the next spin in the buffer
+        self.layout = None # the WheelLayout the bins were built from
+        self.reset(38)
+
+    def reset(self, size):
+        """
+        replaces the BINs with SIZE empty ones
+        """
+        self.bins = tuple( Bin() for i in range(size) )
+        self.bin_index = dict( (b, i) for i, b in enumerate(self.bins) ) # Bin : bin number
+        self.all_outcomes = set()
+        self.outcome_index = {} # lower case name : canonical Outcome
+        self.outcome_bins = {} # lower case name : set of the bin numbers the Outcome wins on
+        self.odds = {} # name : the odds the wheel pays on the Outcome
 
     def add_outcome(self, number, outcome):
         """
@@ -63,13 +133,58 @@ class Wheel(object):
         """
 
         self.bins[number].add(outcome)
-        self.all_outcomes = self.all_outcomes | frozenset([outcome])
+        self.all_outcomes.add(outcome)
+
+        key = outcome.name.lower()
+        self.outcome_index.setdefault(key, outcome)
+        self.outcome_bins.setdefault(key, set()).add(number)
+        self.odds.setdefault(outcome.name, outcome.odds)
+
+    def freeze(self):
+        """
+        freezes the BINs once every OUTCOME has been added
+        """
+        for b in self.bins:
+            b.freeze()
+        self.all_outcomes = frozenset(self.all_outcomes)
 
     def next(self):
         """
         returns a Bin selected at random from the wheel.
         """
-        return self.rng.choice(self.bins)
+        if self.position < len(self.buffer):
+            self.position += 1
+            return self.bins[self.buffer[self.position - 1]]
+        if self.backend is None:
+            return self.rng.choice(self.bins)
+
+        self.buffer = self.backend.spins(self.block_size, len(self.bins))
+        self.position = 1
+        return self.bins[self.buffer[0]]
+
+    def draw(self, n):
+        """
+        returns the numbers of the next N BINs the wheel would spin, for replay()
+        """
+        return list( self.bin_index[self.next()] for i in range(n) )
+
+    def replay(self, spins):
+        """
+        makes next() return the BINs with the given numbers, in order, before spinning at random again
+        """
+        self.buffer = spins
+        self.position = 0
+
+    def seed(self, value):
+        """
+        reseeds the BACKEND, or the RNG when there is none, and drops the prefetched spins
+        """
+        if self.backend is not None:
+            self.backend.seed(value)
+        else:
+            self.rng.seed(value)
+        self.buffer = []
+        self.position = 0
 
     def get(self, bin):
         """
@@ -78,9 +193,124 @@ class Wheel(object):
         return self.bins[bin]
 
     def get_outcome(self, name):
-        OC = set([  oc for oc in self.all_outcomes if oc.name.lower() == name.lower()  ])
-        assert len(OC) == 1
-        return OC
+        """
+        returns the canonical OUTCOME with the given name. Names are case insensitive.
+        """
+        return self.outcome_index[name.lower()]
+
+    def get_bins(self, name):
+        """
+        returns the numbers of the BINs the OUTCOME with the given name wins on
+        """
+        return self.outcome_bins[name.lower()]
+
+    def is_winner(self, name, bin):
+        """
+        returns True if the OUTCOME with the given name wins on the given BIN
+        """
+        return self.bin_index[bin] in self.outcome_bins[name.lower()]
+
+
+class RandomBackend(object):
+    """
+    Wheel backend on Python's Mersenne Twister. For the same seed it spins the same bins as a Wheel built on
+    random.Random, but a block at a time.
+    """
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+    def seed(self, value):
+        self.rng.seed(value)
+
+    def spins(self, n, size):
+        """
+        returns n bin numbers drawn uniformly from range(size)
+        """
+        _random = self.rng.random
+        return [ int(_random() * size) for i in xrange(n) ]
+
+
+class NumpyBackend(object):
+    """
+    Wheel backend on a NumPy generator: PCG64 where NumPy provides it, the MT19937 RandomState otherwise.
+    Requires numpy.
+    """
+    def __init__(self, seed=None):
+        if numpy is None:
+            raise ImportError("NumpyBackend requires numpy")
+        self.seed(seed)
+
+    def seed(self, value):
+        if hasattr(numpy.random, "PCG64"):
+            self.rng = numpy.random.Generator(numpy.random.PCG64(value))
+            self.integers = self.rng.integers
+        else:
+            if value is not None:
+                # RandomState takes its seed as 32 bit words
+                value = [ (value >> shift) & 0xffffffff for shift in range(0, max(value.bit_length(), 1), 32) ]
+            self.rng = numpy.random.RandomState(value)
+            self.integers = self.rng.randint
+
+    def spins(self, n, size):
+        return self.integers(0, size, n).tolist()
+
+    def __getstate__(self):
+        # the bound integers method doesn't pickle, it is bound again to the restored generator
+        return {"rng": self.rng}
+
+    def __setstate__(self, state):
+        self.rng = state["rng"]
+        self.integers = self.rng.integers if hasattr(self.rng, "integers") else self.rng.randint
+
+
+class CounterBackend(object):
+    """
+    Counter-based Wheel backend: spin i is the SplitMix64 hash of the seed and i. The stream is the same on every
+    platform and any position in it can be reached directly with skip(). Blocks are hashed as uint64 arrays when
+    numpy is installed and one spin at a time otherwise, to the same spins.
+    """
+    _mask = (1 << 64) - 1
+
+    def __init__(self, seed=None):
+        self.seed(seed)
+
+    def seed(self, value):
+        # unseeded, like the other backends, a fresh key is drawn from the system's entropy
+        if value is None:
+            value = random.SystemRandom().getrandbits(64)
+        self.key = value & CounterBackend._mask
+        self.counter = 0
+
+    def skip(self, n):
+        self.counter += n
+
+    def spins(self, n, size):
+        if numpy is not None:
+            return self.numpy_spins(n, size)
+        return self.python_spins(n, size)
+
+    def numpy_spins(self, n, size):
+        # uint64 arithmetic wraps modulo 2 ** 64 as the masks do
+        u64 = numpy.uint64
+        z = numpy.arange(self.counter + 1, self.counter + n + 1, dtype=u64) * u64(0x9e3779b97f4a7c15) + u64(self.key)
+        z = (z ^ (z >> u64(30))) * u64(0xbf58476d1ce4e5b9)
+        z = (z ^ (z >> u64(27))) * u64(0x94d049bb133111eb)
+        self.counter += n
+        return ((z ^ (z >> u64(31))) % u64(size)).astype(numpy.int64).tolist()
+
+    def python_spins(self, n, size):
+        mask = CounterBackend._mask
+        spins = []
+        for i in xrange(self.counter + 1, self.counter + n + 1):
+            z = (self.key + i * 0x9e3779b97f4a7c15) & mask
+            z = ((z ^ (z >> 30)) * 0xbf58476d1ce4e5b9) & mask
+            z = ((z ^ (z >> 27)) * 0x94d049bb133111eb) & mask
+            spins.append((z ^ (z >> 31)) % size)
+        self.counter += n
+        return spins
+
+
+BACKENDS = {'mt': RandomBackend, 'numpy': NumpyBackend, 'counter': CounterBackend}
 
 
 class NonRandom(random.Random):
@@ -100,15 +330,50 @@ class NonRandom(random.Random):
         return seq[self.value]
 
 
+class TiltedRandom(random.Random):
+    """
+    TiltedRandom is a random number generator for importance sampling. Once tilt() has given it weights, choice()
+    picks from the sequence in proportion to them instead of uniformly, and multiplies LIKELIHOOD by the ratio of
+    the uniform to the tilted probability of every pick, so weighting a session by its likelihood undoes the tilt.
+    Given a CONDITION, only the picks made while it returns True are tilted.
+    """
+    def __init__(self, seed=None):
+        random.Random.__init__(self, seed)
+        self.cumulative = None # running totals of the tilted probabilities
+        self.ratios = None # uniform over tilted probability, by index
+        self.likelihood = 1.0
+        self.condition = None
+
+    def tilt(self, weights):
+        """
+        sets the relative weight of each index of the sequences choice() is given
+        """
+        total = float(sum(weights))
+        if total <= 0 or min(weights) <= 0:
+            raise ValueError("every weight must be positive")
+        self.cumulative = []
+        running = 0.0
+        for w in weights:
+            running += w / total
+            self.cumulative.append(running)
+        self.ratios = list( total / (len(weights) * w) for w in weights )
+
+    def choice(self, seq):
+        if self.cumulative is None or (self.condition is not None and not self.condition()):
+            return random.Random.choice(self, seq)
+        i = min(bisect.bisect_right(self.cumulative, self.random()), len(seq) - 1)
+        self.likelihood *= self.ratios[i]
+        return seq[i]
+
+
 class BinBuilder(object):
 
-    def __init__(self):
-        pass
+    def __init__(self, layout="american"):
+        self.layout = layout # "american", "european" or the path of a layout file
 
     def build_bins(self, wheel):
         """
-        creates the OUTCOME instances and uses the add_outcome() method to place each OUTCOME in the appropriate BIN
-        of the WHEEL.
+        places each OUTCOME in the appropriate BIN of the WHEEL, from the compiled WheelLayout.
 
         There should be separate methods to generate the straight bets, split bets, street bets, corner bets, line bets,
          dozen bets and column bets, even money bets and the special case of zero and double zero.
@@ -116,25 +381,33 @@ class BinBuilder(object):
         The pool of Outcome objects must be reduced so that each outcome object has unique attributes.
         """
         self.wheel = wheel
+        WheelLayout.load(self.layout).build(wheel)
 
-        outcome_dict = {}
-        outcomes_list = self.strait_bets()+\
-                       self.split_bets()+\
-                       self.street_bet()+\
-                       self.corner_bet()+\
-                       self.five_bet()+\
-                       self.line_bet()+\
-                       self.dozen_bet()+\
-                       self.column_bet()+\
-                       self.even_money_bet()
-
-        # create a name : outcome dict so that there is only one Outcome obj per unique name
-        for bo_tup in outcomes_list:
-            outcome_dict[bo_tup[1].name] = bo_tup[1]
-
-        for bo_tup in outcomes_list:
-            # add the outcomes to wheel using only Outcome objects with unique attributes
-            self.wheel.add_outcome(  bo_tup[0]  , outcome_dict[bo_tup[1].name]  )
+    def american_outcomes(self):
+        """
+        returns the (bin number, OUTCOME) pairs of the 38 bin American wheel, zero and double zero
+        """
+        return self.strait_bets()+\
+               self.split_bets()+\
+               self.street_bet()+\
+               self.corner_bet()+\
+               self.five_bet()+\
+               self.line_bet()+\
+               self.dozen_bet()+\
+               self.column_bet()+\
+               self.even_money_bet()
+
+    def european_outcomes(self):
+        """
+        returns the (bin number, OUTCOME) pairs of the 37 bin European wheel: no double zero and so no five bet
+        """
+        return list( (n, oc) for n, oc in self.american_outcomes() if n != 37 and oc.name != "Five Bet" )
+
+    def build_payouts(self, wheel):
+        """
+        compiles a WHEEL whose bins are already built into a PayoutMatrix
+        """
+        return PayoutMatrix(wheel)
 
     def strait_bets(self):
         """
@@ -254,15 +527,212 @@ class BinBuilder(object):
         return outcome_list
 
 
+class WheelLayout(object):
+    """
+    WheelLayout is a compiled wheel definition: its OUTCOMEs as (name, odds) and, for each bin, the indexes of the
+    OUTCOMEs that bin pays. Layouts are immutable and serialize with marshal. Compiled layouts are kept in memory for
+    the life of the process and, when CACHE_DIR is set ($ROULETTE_CACHE), cached on disk and read back from there
+    when loaded again.
+    The built-in layouts' OUTCOMEs are the canonical Outcome.intern() ones. A layout file shares those where it pays
+    the same odds and has its own OUTCOMEs otherwise, so it can pay other odds on an existing name.
+
+    A layout file is JSON: {"name": ..., "size": <number of bins>, "outcomes": [[name, odds, [bin numbers]], ...]}
+    """
+    version = 1 # bump when the compiled form or the built-in layouts change
+    builtin = ("american", "european")
+    cache_dir = os.environ.get("ROULETTE_CACHE") # None keeps the compiled layouts off the disk
+    _loaded = {} # layout spec : WheelLayout
+
+    def __init__(self, name, outcomes, bins):
+        self.name = name
+        self.outcomes = tuple( (str(n), int(odds)) for n, odds in outcomes )
+        self.bins = tuple( tuple(b) for b in bins )
+        self._outcomes = None # the OUTCOMEs the layout builds wheels with, made on first use
+
+    @classmethod
+    def from_pairs(cls, name, size, pairs):
+        """
+        compiles (bin number, OUTCOME) pairs, as BinBuilder produces them, into a layout of SIZE bins
+        """
+        columns = {} # name : index in outcomes
+        outcomes = []
+        bins = list( [] for i in range(size) )
+        for number, outcome in pairs:
+            if outcome.name not in columns:
+                columns[outcome.name] = len(outcomes)
+                outcomes.append((outcome.name, outcome.odds))
+            if columns[outcome.name] not in bins[number]:
+                bins[number].append(columns[outcome.name])
+        return cls(name, outcomes, bins)
+
+    @classmethod
+    def from_json(cls, text):
+        definition = json.loads(text)
+        pairs = list( (n, Outcome(name, odds)) for name, odds, numbers in definition["outcomes"] for n in numbers )
+        return cls.from_pairs(definition["name"], definition["size"], pairs)
+
+    def dumps(self):
+        return marshal.dumps((WheelLayout.version, self.name, self.outcomes, self.bins))
+
+    @classmethod
+    def loads(cls, data):
+        version, name, outcomes, bins = marshal.loads(data)
+        if version != WheelLayout.version:
+            raise ValueError("layout version %d, expected %d" % (version, WheelLayout.version))
+        return cls(name, outcomes, bins)
+
+    @classmethod
+    def load(cls, spec):
+        """
+        returns the compiled layout for SPEC, "american", "european" or the path of a layout file, compiling it the
+        first time, or reading it from CACHE_DIR when it has been compiled there before
+        """
+        if spec in cls._loaded:
+            return cls._loaded[spec]
+
+        if spec in cls.builtin:
+            key = "%s-v%d" % (spec, cls.version)
+            data = None
+        else:
+            with open(spec, "rb") as f:
+                data = f.read()
+            key = "custom-v%d-%s" % (cls.version, hashlib.sha1(data).hexdigest())
+        path = None if cls.cache_dir is None else os.path.join(cls.cache_dir, key + ".layout")
+
+        layout = None
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    layout = cls.loads(f.read())
+            except (IOError, OSError, ValueError, EOFError, TypeError):
+                pass
+        if layout is None:
+            if spec == "american":
+                layout = cls.from_pairs(spec, 38, BinBuilder().american_outcomes())
+            elif spec == "european":
+                layout = cls.from_pairs(spec, 37, BinBuilder().european_outcomes())
+            else:
+                layout = cls.from_json(data)
+            if path is not None:
+                layout.save(path)
+
+        cls._loaded[spec] = layout
+        return layout
+
+    def save(self, path):
+        """
+        writes the compiled layout to PATH atomically. The cache is an optimization, so failures are ignored
+        """
+        try:
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.dumps())
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            pass
+
+    def outcome_objects(self):
+        """
+        returns the OUTCOMEs of the layout, canonical where they can be without registering a custom layout's odds
+        """
+        if self._outcomes is None:
+            if self.name in WheelLayout.builtin:
+                self._outcomes = tuple( Outcome.intern(name, odds) for name, odds in self.outcomes )
+            else:
+                registry = Outcome._registry
+                self._outcomes = tuple( registry[name] if name in registry and registry[name].odds == odds
+                                        else Outcome(name, odds) for name, odds in self.outcomes )
+        return self._outcomes
+
+    def build(self, wheel):
+        """
+        replaces the BINs of WHEEL with the ones of this layout and freezes them
+        """
+        wheel.reset(len(self.bins))
+        outcomes = self.outcome_objects()
+        for number, columns in enumerate(self.bins):
+            for column in columns:
+                wheel.add_outcome(number, outcomes[column])
+        wheel.freeze()
+        wheel.layout = self
+
+
+class PayoutMatrix(object):
+    """
+    PayoutMatrix is a WHEEL compiled into a dense table of bin by outcome payout multipliers. Row n holds what a unit
+    wager on each OUTCOME returns when BIN n comes up: the odds plus the wager for a winner, 0 for a loser.
+    Settling a spin is a single row lookup followed by a dot product with the bets, whatever the number of OUTCOMEs.
+    Columns are keyed by the OUTCOME's own name: its str hash is cached, where hashing the OUTCOME itself, or
+    lower-casing its name, would be Python work for every bet.
+    """
+    def __init__(self, wheel):
+        names = sorted(wheel.outcome_index)
+        self.columns = dict( (wheel.outcome_index[name].name, col) for col, name in enumerate(names) ) # name : column
+        self.bin_index = wheel.bin_index
+
+        rows = list( [0] * len(names) for b in wheel.bins )
+        for col, name in enumerate(names):
+            multiplier = wheel.outcome_index[name].odds + 1
+            for number in wheel.outcome_bins[name]:
+                rows[number][col] = multiplier
+        self.rows = tuple( tuple(r) for r in rows )
+
+    def row(self, bin):
+        """
+        returns the row of payout multipliers for the given BIN
+        """
+        return self.rows[self.bin_index[bin]]
+
+    def payout(self, row, bet):
+        """
+        returns the amount the BET returns (wager included) for the given row, 0 when it loses
+        """
+        return bet.amount * row[self.columns[bet.outcome.name]]
+
+    def returns(self, bin, bets):
+        """
+        returns the amount each of the BETs returns (wager included) when the given BIN comes up, in one pass
+        """
+        row, columns = self.rows[self.bin_index[bin]], self.columns
+        return [ b.amount * row[columns[b.outcome.name]] for b in bets ]
+
+    def settle(self, bin, bets):
+        """
+        returns the total amount returned to the BETs when the given BIN comes up
+        """
+        return sum(self.returns(bin, bets))
+
+
 class Bet(object):
     """
     Bet associates an amount and an Outcome. We can also associate a Bet with a Player.
-    class which produces references to Outcomes as needed.
+    class which produces references to Outcomes as needed. Bets are immutable, so players can reuse them.
     """
+    __slots__ = ('amount', 'outcome')
 
     def __init__(self, amount, outcome):
-        self.amount = amount
-        self.outcome = outcome
+        object.__setattr__(self, 'amount', amount)
+        object.__setattr__(self, 'outcome', outcome)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Bet is immutable")
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return Bet, (self.amount, self.outcome)
+
+    def __eq__(self, other):
+        return self.amount == other.amount and self.outcome == other.outcome
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.amount, self.outcome))
 
     def win_amount(self):
         return self.amount + self.outcome.win_amount(self.amount)
@@ -276,31 +746,47 @@ class Bet(object):
 
 class Table(object):
     """
+    Table holds the BETs placed for the next spin in the order they were placed. It keeps a running total of the
+    BETs so checking the table limit costs the same however many BETs there are.
     """
     def __init__(self, limit):
         assert type(limit) == int
         self.limit = limit
-        self.bets = []
+        self.bets = collections.deque()
+        self.total = 0
+        self.rejected = 0 # BETs is_valid has turned down for being over the limit
 
     def is_valid(self, bet):
-        bets_total = sum(list(b.amount for b in self.bets))
-        if bets_total + bet.amount <= self.limit:
+        if self.total + bet.amount <= self.limit:
             return True
-        else:
-            return False
+        self.rejected += 1
+        return False
 
     def place_bet(self, bet):
 
         self.bets.append(bet)
-        bets_total = sum(list(b.amount for b in self.bets))
-        if bets_total > self.limit:
+        self.total += bet.amount
+        if self.total > self.limit:
             raise InvalidBet(self.bets)
 
     def remove_bet(self):
-        self.bets = self.bets[1::]
+        if self.bets:
+            self.total -= self.bets.popleft().amount
+
+    def settle(self):
+        """
+        clears the table and returns its BETs in the order they were placed
+        """
+        bets = self.bets
+        self.bets = collections.deque()
+        self.total = 0
+        return bets
 
     def __iter__(self):
-        return self.bets[:].__iter__()
+        return iter(self.bets)
+
+    def __len__(self):
+        return len(self.bets)
 
     def __str__(self):
         return str(list( str(b) for b in self.bets ) )
@@ -321,7 +807,14 @@ class InvalidBet(Exception):
 class Player(object):
     """
     Abstract player superclass
+    WATCHES names the OUTCOMEs winners() looks at. The game calls winners() only on spins where one of them wins
+    or where they stop winning; None, the default, has it called on every spin and () never.
+    The game calls win(bet, amount) with the amount the wheel returns for a winning BET, so a subclass overriding
+    win() takes AMOUNT too.
     """
+    watches = None
+    watched = frozenset() # the watched OUTCOMEs that won the last spin the player was told about
+
     def __init__(self, table, stake=100, rounds_to_go=100):
         self.table = table
         self.stake = stake
@@ -348,11 +841,28 @@ class Player(object):
     def reset_class_defaults(self):
         pass
 
+    def parameters(self):
+        """
+        returns the strategy parameters the player was created with, as keyword arguments
+        """
+        return {}
+
+    def machine(self):
+        """
+        returns the StrategyMachine BatchSimulator runs for this player, or None when it has none. Only a machine()
+        the player's own class defines is run: a subclass may play differently from the machine it would inherit
+        """
+        return None
+
     def winners(self, wheel_obj, winning_bin):
         pass
 
-    def win(self, bet):
-        self.stake += bet.win_amount()
+    def win(self, bet, amount=None):
+        """
+        takes back the AMOUNT the game returns for the winning BET, wager included; by default what the BET's own
+        OUTCOME pays
+        """
+        self.stake += bet.win_amount() if amount is None else amount
 
     def lose(self, bet):
         pass
@@ -368,14 +878,17 @@ class Martingale(Player):
     """
     Martingale is a Player as described: https://en.wikipedia.org/wiki/Martingale_(betting_system)
     """
+    watches = ()
     _base_wager = 1
     _loss_count = 0
-    def __init__(self, table, stake, rounds_to_go):
+    def __init__(self, table, stake, rounds_to_go, base_wager=_base_wager):
         Player.__init__(self, table, stake, rounds_to_go)
-        self.base_wager = 1
+        self._base_wager = base_wager # restored by reset_class_defaults
+        self.base_wager = base_wager
         self.loss_count = 0
         self.bet_multiple = 2**self.loss_count # this should always equal 2**loss_count
-        self.black = Outcome("Black", 1)
+        self.black = Outcome.intern("Black", 1)
+        self.bets = {} # amount : Bet, reused across spins
 
     def place_bets(self):
         """
@@ -383,7 +896,10 @@ class Martingale(Player):
         """
         self.bet_multiple = 2**self.loss_count
 
-        _bet =  Bet(self.base_wager*self.bet_multiple, self.black)
+        amount = self.base_wager*self.bet_multiple
+        _bet = self.bets.get(amount)
+        if _bet is None:
+            _bet = self.bets[amount] = Bet(amount, self.black)
         # print "__1__",self.stake, _bet.amount
 
         if (self.stake - _bet.amount) < 0:
@@ -394,26 +910,35 @@ class Martingale(Player):
             self.table.place_bet(_bet)
 
 
-    def win(self, bet):
+    def win(self, bet, amount=None):
         self.loss_count = 0
-        self.stake += bet.win_amount()
+        Player.win(self, bet, amount)
 
     def lose(self, bet):
         self.loss_count += 1
 
 
     def reset_class_defaults(self):
-        self.base_wager = Martingale._base_wager
+        self.base_wager = self._base_wager
         self.loss_count = Martingale._loss_count
 
+    def parameters(self):
+        return {"base_wager": self._base_wager}
+
+    def machine(self):
+        return MartingaleMachine(self._base_wager)
+
 
 class SevenReds(Martingale):
     """
     SevenReds is a Martingale player who only places bets after the wheel has spun red 7 times
     """
-    def __init__(self, table, stake, rounds_to_go):
-        Martingale.__init__(self, table, stake, rounds_to_go)
+    watches = ("Red",)
+
+    def __init__(self, table, stake, rounds_to_go, base_wager=Martingale._base_wager):
+        Martingale.__init__(self, table, stake, rounds_to_go, base_wager)
         self.redCount = 7
+        self.red = Outcome.intern("Red", 1)
 
     def playing(self):
         if self.rounds_to_go > 0 and self.stake > 0 and self.redCount == 0:
@@ -425,31 +950,53 @@ class SevenReds(Martingale):
     def winners(self, wheel_obj, winning_bin):
         """
         The winning_bin is the BIN selected by WHEEL.
-        I also include the wheel_object just because it makes it easier to compare outcomes when we
-        have access to the get_outcome method. Object equality yo! Might want to refactor that...
+        Outcomes hash by name, so the interned red OUTCOME can be looked up in the BIN directly.
         """
-        _red_outcome = Outcome("Red", 1)
-        singleton_red_outcome = wheel_obj.get_outcome(_red_outcome.name)
-        if singleton_red_outcome.pop() in winning_bin.outcomes:
+        if self.red in winning_bin.outcomes:
             self.redCount -= 1
         else:
             self.redCount = 7
 
+    def machine(self):
+        return SevenRedsMachine(self._base_wager)
+
 
 class Passenger57(Player):
     """
     Passenger57 always bets black
     """
+    watches = ()
+
     def __init__(self, table, stake, rounds_to_go):
         Player.__init__(self, table, stake, rounds_to_go)
-        self.black = Outcome("Black", 1)
+        self.black = Outcome.intern("Black", 1)
+        self.bet = Bet(1, self.black)
 
     def place_bets(self):
-        _bet = Bet(1, self.black)
+        _bet = self.bet
         if self.is_valid(_bet):
             self.stake -= _bet.amount
             self.table.place_bet(_bet)
 
+    def machine(self):
+        return StrategyMachine()
+
+
+STRATEGIES = {'martingale': Martingale, 'sevenreds': SevenReds, 'passenger57': Passenger57}
+
+
+def register_strategy(name, player_class):
+    """
+    makes a Player subclass available by NAME, to RunGame's --player among others. Names are case insensitive.
+    """
+    if not (isinstance(player_class, type) and issubclass(player_class, Player)):
+        raise TypeError("%r is not a Player class" % (player_class,))
+    key = name.lower()
+    if STRATEGIES.get(key, player_class) is not player_class:
+        raise ValueError("strategy %s is already registered as %s" % (name, STRATEGIES[key].__name__))
+    STRATEGIES[key] = player_class
+    return player_class
+
 
 class RouletteGame(object):
     """
@@ -458,14 +1005,52 @@ class RouletteGame(object):
         spinning the wheel
         resolving the BETs are actually present on the table
     """
-    def __init__(self, wheel, table):
+    def __init__(self, wheel, table, payouts=None):
         self.wheel = wheel
         self.table = table
+        self.payouts = payouts # optional PayoutMatrix used to settle the bets
+        self.profiler = None # optional Profiler, cycle() takes the timed path when it is set
+        self.watch_bins = None # the wheel's BINs the watch masks were built for
+        self.watch_masks = {} # watches : { BIN : frozenset of the watched OUTCOMEs it wins }
 
     def notify_player(self, player, wheel_obj, winning_bin ):
         player.winners(wheel_obj, winning_bin )
 
+    def notify_watcher(self, player, winning_bin):
+        """
+        notifies a PLAYER with WATCHES only when a watched OUTCOME wins, or on the first spin none of them does
+        """
+        if self.watch_bins is not self.wheel.bins:
+            self.watch_bins, self.watch_masks = self.wheel.bins, {}
+        mask = self.watch_masks.get(player.watches)
+        if mask is None:
+            mask = self.watch_masks[player.watches] = self.watch_mask(player.watches)
+
+        watched = mask[winning_bin]
+        if watched or player.watched:
+            player.watched = watched
+            self.notify_player(player, wheel_obj=self.wheel, winning_bin=winning_bin)
+
+    def watch_mask(self, watches):
+        """
+        returns the watched OUTCOMEs each BIN of the wheel wins
+        """
+        outcomes = set( self.wheel.get_outcome(name) for name in watches )
+        return dict( (b, frozenset(outcomes & b.outcomes)) for b in self.wheel.bins )
+
+    def returns(self, win_bin, bets):
+        """
+        returns the amount each of the BETs returns, wager included, when WIN_BIN comes up. Winners are paid the odds
+        of the wheel's OUTCOME, which a custom layout may set apart from the OUTCOME the player bet on.
+        """
+        if self.payouts is not None:
+            return self.payouts.returns(win_bin, bets)
+        outcomes, odds = win_bin.outcomes, self.wheel.odds
+        return [ b.amount * (odds[b.outcome.name] + 1) if b.outcome in outcomes else 0 for b in bets ]
+
     def cycle(self, player):
+        if self.profiler is not None:
+            return self.profiled_cycle(player)
 
         if player.playing():
             # command player to place a bet
@@ -474,20 +1059,549 @@ class RouletteGame(object):
         # this returns an bin class object which contains Outcomes.OUTCOMES are an attribute of BIN
         win_bin = self.wheel.next()
 
-        for bet in self.table:
-            outcomes_matching_bet_name = self.wheel.get_outcome(bet.outcome.name)
-            assert len(outcomes_matching_bet_name) == 1
-            if outcomes_matching_bet_name.pop() in win_bin.outcomes:
-                player.win(bet)
+        # take every bet off the table at once and settle them
+        bets = self.table.settle()
+        for bet, returned in itertools.izip(bets, self.returns(win_bin, bets)):
+            if returned:
+                player.win(bet, returned)
             else:
                 player.lose(bet)
 
-            # remove the bet
-            self.table.remove_bet()
-        else:
+        if player.watches is None:
             # send winning bin to play so they can see winning the outcomes even when they don't play
             self.notify_player(player, wheel_obj=self.wheel, winning_bin=win_bin)
-            player.rounds_to_go -= 1 # reduce roundToGo
+        elif player.watches:
+            self.notify_watcher(player, win_bin)
+        player.rounds_to_go -= 1 # reduce roundToGo
+
+    def cycle_all(self, players):
+        """
+        plays one round for every one of the PLAYERS that still has rounds and stake. They place their BETs in seat
+        order, all under the one table limit, then a single spin settles each BET with the player that placed it.
+        """
+        table = self.table
+        seated = [] # (player, number of BETs on the table once they had placed theirs)
+        for player in players:
+            if player.rounds_to_go != 0 and player.stake != 0:
+                if player.playing():
+                    player.place_bets()
+                seated.append((player, len(table)))
+
+        win_bin = self.wheel.next()
+        bets = list(table.settle())
+        won = self.returns(win_bin, bets)
+
+        start = 0
+        for player, end in seated:
+            for bet, returned in itertools.izip(bets[start:end], won[start:end]):
+                if returned:
+                    player.win(bet, returned)
+                else:
+                    player.lose(bet)
+            start = end
+
+            if player.watches is None:
+                self.notify_player(player, wheel_obj=self.wheel, winning_bin=win_bin)
+            elif player.watches:
+                self.notify_watcher(player, win_bin)
+            player.rounds_to_go -= 1
+
+    def profiled_cycle(self, player):
+        """
+        plays a cycle() like the untimed one, adding the time of each phase and the counts of spins, bets, wins and
+        losses to the PROFILER
+        """
+        profiler = self.profiler
+        clock, seconds = profiler.clock, profiler.seconds
+
+        start = clock()
+        if player.playing():
+            rejected = self.table.rejected
+            player.place_bets()
+            profiler.rejected += self.table.rejected - rejected
+        profiler.bets += len(self.table)
+        now = clock()
+        seconds["place_bets"] += now - start
+
+        start = now
+        win_bin = self.wheel.next()
+        profiler.spins += 1
+        now = clock()
+        seconds["spin"] += now - start
+
+        start = now
+        bets = self.table.settle()
+        for bet, returned in itertools.izip(bets, self.returns(win_bin, bets)):
+            if returned:
+                profiler.wins += 1
+                player.win(bet, returned)
+            else:
+                profiler.losses += 1
+                player.lose(bet)
+        now = clock()
+        seconds["settle"] += now - start
+
+        start = now
+        if player.watches is None:
+            self.notify_player(player, wheel_obj=self.wheel, winning_bin=win_bin)
+        elif player.watches:
+            self.notify_watcher(player, win_bin)
+        player.rounds_to_go -= 1
+        seconds["notify"] += clock() - start
+
+
+class Profiler(object):
+    """
+    Profiler collects the time spent in each phase of RouletteGame.cycle and in Simulator.session's bookkeeping, and
+    counts spins, bets placed, bets the Table rejected, wins and losses. Profiling is off until a Profiler is set as
+    the game's PROFILER; it only sees the sessions played in its own process.
+    """
+    phases = ("place_bets", "spin", "settle", "notify", "record")
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.seconds = dict.fromkeys(self.phases, 0.0)
+        self.spins = 0
+        self.bets = 0
+        self.rejected = 0
+        self.wins = 0
+        self.losses = 0
+
+    def report(self):
+        total = sum(self.seconds.values())
+        print "-Profile- "
+        for phase in self.phases:
+            print "%s: [ %f s ] [ %.1f %% ] [ %.3f us/spin ] " % \
+                  (phase, self.seconds[phase], 100.0 * self.seconds[phase] / total if total else 0.0,
+                   1e6 * self.seconds[phase] / self.spins if self.spins else 0.0)
+        print "Spins: [ %d ] \nBets Placed: [ %d ] \nBets Rejected: [ %d ] \nWins: [ %d ] \nLosses: [ %d ] \n\n" % \
+              (self.spins, self.bets, self.rejected, self.wins, self.losses)
+
+
+class RunningStats(object):
+    """
+    RunningStats keeps the count, mean, population variance, minimum and maximum of a stream of values in constant
+    memory, using Welford's single pass update. It can also keep P2Quantile sketches for the given quantiles.
+    """
+    def __init__(self, quantiles=()):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared differences from the mean
+        self.min = None
+        self.max = None
+        self.quantiles = list( P2Quantile(p) for p in quantiles )
+
+    def push(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / float(self.count)
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+        for q in self.quantiles:
+            q.push(x)
+
+    def variance(self):
+        return self.m2 / self.count
+
+    def standard_deviation(self):
+        return math.sqrt(self.variance())
+
+    def merge(self, other):
+        """
+        adds the values OTHER has seen, with Chan's pairwise update, and returns self. P2Quantile sketches don't
+        merge, so neither may keep any; use a Histogram for quantiles across workers.
+        """
+        if self.quantiles or other.quantiles:
+            raise ValueError("RunningStats with quantile sketches can't be merged")
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / float(count)
+        self.m2 += other.m2 + delta * delta * self.count * other.count / float(count)
+        self.count = count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+
+class P2Quantile(object):
+    """
+    P2Quantile estimates the p-quantile of a stream of values with five markers, using the P-square algorithm of
+    Jain and Chlamtac. Memory stays constant whatever the length of the stream.
+    """
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5]
+        self.increments = [0, p / 2.0, p, (1 + p) / 2.0, 1]
+
+    def push(self, x):
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # move the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self.parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * float(q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + float(d) / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * float(q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * float(q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        """
+        returns the current estimate, the exact quantile while fewer than five values have been seen
+        """
+        if len(self.heights) < 5:
+            return self.heights[int(round(self.p * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+
+class Histogram(object):
+    """
+    Histogram counts a stream of values in bins of WIDTH, kept in a dict so only the occupied bins take memory. Two
+    Histograms of the same WIDTH merge by adding their counts, so the ones worker processes keep combine into the
+    histogram of the whole run. With the default WIDTH of 1 the quantiles of integer values are exact.
+    """
+    def __init__(self, width=1):
+        self.width = width
+        self.counts = {} # bin : values in it, bin b holds [b * WIDTH, (b + 1) * WIDTH)
+        self.count = 0
+
+    def push(self, x):
+        b = int(math.floor(x / self.width)) if self.width != 1 else int(x)
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        """
+        adds the counts of OTHER and returns self
+        """
+        if other.width != self.width:
+            raise ValueError("can't merge a Histogram of width %s into one of width %s" % (other.width, self.width))
+        counts = self.counts
+        for b, n in other.counts.iteritems():
+            counts[b] = counts.get(b, 0) + n
+        self.count += other.count
+        return self
+
+    def at_most(self, x):
+        """
+        returns how many values fell in the bins up to the one holding X
+        """
+        last = int(math.floor(x / self.width))
+        return sum( n for b, n in self.counts.iteritems() if b <= last )
+
+    def quantile(self, p):
+        """
+        returns the lowest value of the bin holding the p-quantile, the smallest value at or above a P fraction of
+        the values
+        """
+        rank = max(1, int(math.ceil(p * self.count)))
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                return b * self.width
+        raise ValueError("empty Histogram has no quantiles")
+
+    def mean(self):
+        """
+        returns the mean of the bins' lowest values, the exact mean with WIDTH 1 and integer values
+        """
+        return float(sum( b * self.width * n for b, n in self.counts.iteritems() )) / self.count
+
+
+class SessionAnalytics(object):
+    """
+    SessionAnalytics keeps the distributions of a Simulator's sessions as Histograms: maxima, duration, final stake,
+    drawdown (the deepest fall of the stake below its running peak) and the round each ruined session went broke in,
+    plus the stake after every one of ROUNDS rounds, a session that has ended keeping its final stake. Sessions are
+    added as they are played, so no stake values are kept, and the analytics of worker processes merge.
+    """
+    percentiles = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+    def __init__(self, rounds, width=1):
+        self.rounds = rounds
+        self.maxima = Histogram(width)
+        self.duration = Histogram()
+        self.final_stake = Histogram(width)
+        self.drawdown = Histogram(width)
+        self.ruin_round = Histogram()
+        self.stakes = list( Histogram(width) for t in range(rounds) ) # stake after round t + 1
+
+    def push(self, duration, maxima, final_stake, drawdown):
+        """
+        adds a finished session; its stakes up to DURATION have been pushed to STAKES already
+        """
+        self.duration.push(duration)
+        self.maxima.push(maxima)
+        self.final_stake.push(final_stake)
+        self.drawdown.push(drawdown)
+        if final_stake == 0:
+            self.ruin_round.push(duration)
+        for stakes in self.stakes[duration:]:
+            stakes.push(final_stake)
+
+    def merge(self, other):
+        """
+        adds the sessions of OTHER and returns self
+        """
+        for name in ("maxima", "duration", "final_stake", "drawdown", "ruin_round"):
+            getattr(self, name).merge(getattr(other, name))
+        for stakes, others in zip(self.stakes, other.stakes):
+            stakes.merge(others)
+        return self
+
+    def ruin_by_round(self):
+        """
+        returns the fraction of sessions that had gone broke by the end of each round, as MarkovEvaluator does
+        """
+        by_round = []
+        total = 0
+        for t in range(1, self.rounds + 1):
+            total += self.ruin_round.counts.get(t, 0)
+            by_round.append(float(total) / self.duration.count)
+        return by_round
+
+    def stake_band(self, t, percentiles=percentiles):
+        """
+        returns the PERCENTILES of the stake after round T
+        """
+        return list( self.stakes[t - 1].quantile(p) for p in percentiles )
+
+    def report(self, name, checkpoints=10):
+        print "-%s's- (distribution) " % name
+        print "Percentiles: [ %s ] " % " ".join( "%g%%" % (100 * p) for p in self.percentiles )
+        for label, histogram in (("Maxima", self.maxima), ("Duration", self.duration),
+                                 ("Final Stake", self.final_stake), ("Drawdown", self.drawdown)):
+            print "%s: [ %s ] " % (label, " ".join( str(histogram.quantile(p)) for p in self.percentiles ))
+        ruin = self.ruin_by_round()
+        rounds = sorted(set( max(1, self.rounds * i // checkpoints) for i in range(1, checkpoints + 1) ))
+        for t in rounds:
+            print "Round %d: [ P(ruin) %f ] [ Stake %s ] " % \
+                  (t, ruin[t - 1], " ".join( str(stake) for stake in self.stake_band(t) ))
+        print "Samples: [ %d ] \n\n" % self.duration.count
+
+
+class ResultSink(object):
+    """
+    ResultSink appends one record per session to a directory holding a NumPy .npy file for each column: player,
+    seed, duration, maxima, final_stake and ruined. Records are buffered and written BUFFER_SIZE at a time; every
+    write appends to the column data and rewrites the fixed size header with the new length, so the files can be
+    memory-mapped with numpy.load(path, mmap_mode='r') while a run is still adding to them. Needs no numpy to write.
+    """
+    columns = (("player", "|S32", None), ("seed", "<u8", "Q"), ("duration", "<i8", "q"), ("maxima", "<i8", "q"),
+               ("final_stake", "<i8", "q"), ("ruined", "|b1", "?"))
+    header_size = 128 # bytes reserved for the magic string and header, leaves room for any length
+
+    def __init__(self, path, buffer_size=65536):
+        self.path = path
+        self.buffer_size = buffer_size
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.buffer = []
+        self.count = None
+        self.files = {}
+        for name, descr, code in self.columns:
+            filename = os.path.join(path, name + ".npy")
+            if os.path.exists(filename):
+                f = open(filename, "r+b")
+                count = self.read_count(f, descr)
+                f.seek(0, os.SEEK_END)
+            else:
+                f = open(filename, "w+b")
+                count = 0
+                self.write_header(f, descr, 0)
+            if self.count is not None and count != self.count:
+                raise ValueError("columns of %s have different lengths" % path)
+            self.count = count
+            self.files[name] = f
+
+    def write(self, player, seed, duration, maxima, final_stake):
+        """
+        buffers the record of one finished session, a session is ruined when it ends with no stake
+        """
+        self.buffer.append((player, seed or 0, duration, -1 if maxima is None else maxima, final_stake,
+                            final_stake == 0))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        appends the buffered records to the column files, then updates their headers
+        """
+        if not self.buffer:
+            return
+        n = len(self.buffer)
+        for i, (name, descr, code) in enumerate(self.columns):
+            values = list( record[i] for record in self.buffer )
+            f = self.files[name]
+            if code is None:
+                f.write("".join( value[:32].ljust(32, "\0") for value in values ))
+            else:
+                f.write(struct.pack("<%d%s" % (n, code), *values))
+        self.count += n
+        self.buffer = []
+        for name, descr, code in self.columns:
+            f = self.files[name]
+            f.flush()
+            self.write_header(f, descr, self.count)
+            f.seek(0, os.SEEK_END)
+            f.flush()
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+    def write_header(self, f, descr, count):
+        header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, count)
+        header = header.ljust(self.header_size - 10 - 1) + "\n"
+        f.seek(0)
+        f.write("\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header)
+
+    def read_count(self, f, descr):
+        f.seek(0)
+        prefix = f.read(10)
+        if prefix[:8] != "\x93NUMPY\x01\x00":
+            raise ValueError("%s is not a ResultSink column" % f.name)
+        size = struct.unpack("<H", prefix[8:])[0]
+        if size != self.header_size - 10:
+            raise ValueError("%s has a header ResultSink can't extend" % f.name)
+        header = ast.literal_eval(f.read(size))
+        if header["descr"] != descr:
+            raise ValueError("%s holds %s, not %s" % (f.name, header["descr"], descr))
+        return header["shape"][0]
+
+    @classmethod
+    def load(cls, path):
+        """
+        returns the columns written to PATH as memory-mapped numpy arrays, by name. Requires numpy.
+        """
+        if numpy is None:
+            raise ImportError("ResultSink.load requires numpy")
+        return dict( (name, numpy.load(os.path.join(path, name + ".npy"), mmap_mode="r"))
+                     for name, descr, code in cls.columns )
+
+
+class ResultCache(object):
+    """
+    ResultCache keeps the sessions of seeded runs, so asking for the same run again costs nothing. Runs are keyed by
+    a sha1 of everything that decides their sessions: the player class and parameters, stake, rounds, table limit,
+    wheel layout, generator backend and master seed, but not the number of samples. The seeds of a run's sessions
+    don't depend on how many there are either, so a run with more samples than are cached plays only the missing
+    ones. The most recently used CAPACITY runs stay in memory and, given a DIRECTORY, every run is saved there as
+    JSON too.
+    """
+    def __init__(self, directory=None, capacity=128):
+        self.directory = directory
+        self.capacity = capacity
+        self.memory = collections.OrderedDict() # key : [(duration, maxima, final stake), ...], least recent first
+
+    def key(self, player_class, parameters, stake, limit, rounds, seed, layout=None, backend_class=None):
+        """
+        returns the key of a run with the given configuration
+        """
+        config = ["%s.%s" % (player_class.__module__, player_class.__name__), sorted(parameters.items()), stake, limit,
+                  rounds, seed, None if layout is None else hashlib.sha1(layout.dumps()).hexdigest(),
+                  None if backend_class is None else backend_class.__name__]
+        return hashlib.sha1(json.dumps(config)).hexdigest()
+
+    def get(self, key):
+        """
+        returns the cached sessions of the run, or an empty list
+        """
+        sessions = self.memory.pop(key, None)
+        if sessions is None and self.directory is not None:
+            try:
+                with open(os.path.join(self.directory, key + ".json")) as f:
+                    sessions = list( tuple(session) for session in json.load(f) )
+            except (IOError, ValueError):
+                pass
+        if sessions is None:
+            return []
+        self.remember(key, sessions)
+        return sessions
+
+    def put(self, key, sessions):
+        """
+        caches the sessions of the run, writing them to DIRECTORY atomically. Failing to write is ignored
+        """
+        self.remember(key, sessions)
+        if self.directory is None:
+            return
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(sessions, f)
+            os.rename(tmp, os.path.join(self.directory, key + ".json"))
+        except (IOError, OSError):
+            pass
+
+    def remember(self, key, sessions):
+        self.memory.pop(key, None)
+        self.memory[key] = sessions
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def sessions(self, key, seeds, play, start=0):
+        """
+        yields the sessions of the run for SEEDS from the START-th on, calling PLAY with the seeds of the ones that
+        aren't cached yet. The run is cached as its last session is played.
+        """
+        cached = self.get(key)[:len(seeds)]
+        for session in cached[start:]:
+            yield session
+        if len(cached) == len(seeds):
+            return
+        if start > len(cached):
+            # only the first sessions of a run are cached, the ones up to START aren't played just to fill the gap
+            for session in play(seeds[start:]):
+                yield session
+            return
+        played = []
+        for session in play(seeds[len(cached):]):
+            played.append(session)
+            if len(cached) + len(played) == len(seeds):
+                # before the last yield, a caller zipping the sessions with their seeds never resumes after it
+                self.put(key, cached + played)
+            if len(cached) + len(played) > start:
+                yield session
 
 
 class Simulator(object):
@@ -500,8 +1614,19 @@ class Simulator(object):
         self.maxima = []
         self.player = player
         self.game = game
+        self.streaming = False # keep RunningStats instead of the duration and maxima lists
+        self.quantiles = () # quantiles sketched in streaming mode
+        self.duration_stats = None
+        self.maxima_stats = None
+        self.sink = None # optional ResultSink every session's record is written to
+        self.cache = None # optional ResultCache of seeded runs
+        self.checkpoint = None # optional path gather() saves its progress to
+        self.checkpoint_every = 1000 # sessions between checkpoints
+        self.analytics = None # optional SessionAnalytics the sessions are added to
 
     def session(self):
+        if self.game.profiler is not None:
+            return self.profiled_session()
         stake_vales = []
 
         while self.player.rounds_to_go != 0 and self.player.stake != 0:
@@ -509,15 +1634,277 @@ class Simulator(object):
             stake_vales.append(self.player.stake)
         return stake_vales
 
-    def gather(self):
-        for i in range(self.samples):
-            self.reset_player()
-            SV = self.session()
-            # print "Stake Values", SV
+    def profiled_session(self):
+        """
+        plays a session() adding the time spent keeping the stake values to the game's PROFILER
+        """
+        profiler = self.game.profiler
+        clock, seconds = profiler.clock, profiler.seconds
+        stake_vales = []
+
+        while self.player.rounds_to_go != 0 and self.player.stake != 0:
+            self.game.cycle(self.player)
+            start = clock()
+            stake_vales.append(self.player.stake)
+            seconds["record"] += clock() - start
+        return stake_vales
+
+    def session_summary(self):
+        """
+        plays a session like session() but returns only its (duration, maxima), without keeping the stake values
+        """
+        player, game = self.player, self.game
+        if game.profiler is not None:
+            return self.profiled_session_summary()
+        duration = 0
+        maxima = None
+
+        while player.rounds_to_go != 0 and player.stake != 0:
+            game.cycle(player)
+            duration += 1
+            if maxima is None or player.stake > maxima:
+                maxima = player.stake
+        return duration, maxima
+
+    def profiled_session_summary(self):
+        """
+        plays a session_summary() adding the time spent keeping the duration and maxima to the game's PROFILER
+        """
+        player, game = self.player, self.game
+        clock, seconds = game.profiler.clock, game.profiler.seconds
+        duration = 0
+        maxima = None
+
+        while player.rounds_to_go != 0 and player.stake != 0:
+            game.cycle(player)
+            start = clock()
+            duration += 1
+            if maxima is None or player.stake > maxima:
+                maxima = player.stake
+            seconds["record"] += clock() - start
+        return duration, maxima
+
+    def analysed_session(self):
+        """
+        plays a session like session_summary() and adds it, with its stake after every round, to the ANALYTICS
+        """
+        player, game, stakes = self.player, self.game, self.analytics.stakes
+        duration = 0
+        maxima = None
+        peak = player.stake
+        drawdown = 0
+
+        while player.rounds_to_go != 0 and player.stake != 0:
+            game.cycle(player)
+            stake = player.stake
+            stakes[duration].push(stake)
+            duration += 1
+            if maxima is None or stake > maxima:
+                maxima = stake
+            if stake > peak:
+                peak = stake
+            elif peak - stake > drawdown:
+                drawdown = peak - stake
+        self.analytics.push(duration, maxima, player.stake, drawdown)
+        return duration, maxima
+
+    def gather(self, workers=1, seed=None, resume=False):
+        """
+        plays SAMPLES sessions and reports their statistics. Given a seed or more than one worker, every session gets
+        its own RNG stream derived from the master seed and the sessions are split across a pool of worker
+        processes; the results are the same whatever the number of workers.
+        Given a CHECKPOINT path, the progress is saved there every CHECKPOINT_EVERY sessions and at the end, and
+        RESUME carries on from the saved progress, with the same results as a run that was never stopped. Seeded
+        ANALYTICS arrive a chunk of sessions at a time, so a checkpoint that falls inside a chunk waits for its end.
+        """
+        start = 0
+        if resume and self.checkpoint is not None and os.path.exists(self.checkpoint):
+            start, seed = self.restore_checkpoint()
+        else:
+            self.open_statistics()
+            if seed is None and workers != 1:
+                seed = random.getrandbits(64)
 
-            self.duration.append(len(SV)) # length of the session List - duration
-            self.maxima.append(max(SV)) # the maximum value in the session List -  maximum metrics
+        if seed is None:
+            seeds = itertools.repeat(None)
+            sessions = self.play_sessions(self.samples - start)
+        else:
+            self.seed = seed
+            seeds = self.sample_seeds(seed)
+            # the cache keeps no stake values for the analytics to be rebuilt from
+            if self.cache is None or self.analytics is not None:
+                sessions = self.gather_seeded(workers, seeds[start:])
+            else:
+                play = lambda seeds: self.gather_seeded(workers, seeds)
+                sessions = self.cache.sessions(self.cache_key(seed), seeds, play, start)
+            seeds = seeds[start:]
+
+        due = False
+        for position, (session_seed, (duration, maxima, stake)) in enumerate(itertools.izip(seeds, sessions),
+                                                                             start + 1):
+            self.record(duration, maxima, stake, session_seed)
+            if self.checkpoint is None:
+                continue
+            due = due or position % self.checkpoint_every == 0 or position == self.samples
+            if due and (self.analytics is None or self.analytics.duration.count == position):
+                self.save_checkpoint(position, seed)
+                due = False
         self.report()
+        if self.analytics is not None:
+            self.analytics.report(self.player.__class__.__name__)
+
+    def save_checkpoint(self, position, seed):
+        """
+        writes the statistics of the first POSITION sessions, the wheel's generator state and the player's fields to
+        CHECKPOINT, atomically. A SINK is flushed first; sessions played after the last checkpoint are played and
+        written to it again on resume.
+        """
+        wheel = self.game.wheel
+        state = {"version": 1, "position": position, "samples": self.samples, "seed": seed,
+                 "duration": self.duration, "maxima": self.maxima,
+                 "duration_stats": self.duration_stats, "maxima_stats": self.maxima_stats, "analytics": self.analytics,
+                 "rng": wheel.rng, "backend": wheel.backend, "buffer": wheel.buffer, "buffer_position": wheel.position,
+                 "player": dict( (k, v) for k, v in self.player.__dict__.items() if k != "table" )}
+        if self.sink is not None:
+            self.sink.flush()
+        directory = os.path.dirname(os.path.abspath(self.checkpoint))
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(zlib.compress(cPickle.dumps(state, cPickle.HIGHEST_PROTOCOL)))
+        os.rename(tmp, self.checkpoint)
+
+    def restore_checkpoint(self):
+        """
+        loads the state save_checkpoint() wrote and returns the number of sessions played and the master seed
+        """
+        with open(self.checkpoint, "rb") as f:
+            state = cPickle.loads(zlib.decompress(f.read()))
+        if state["samples"] != self.samples:
+            raise ValueError("%s is a checkpoint of %d samples, not %d" % (self.checkpoint, state["samples"],
+                                                                          self.samples))
+        wheel = self.game.wheel
+        self.duration, self.maxima = state["duration"], state["maxima"]
+        self.duration_stats, self.maxima_stats = state["duration_stats"], state["maxima_stats"]
+        self.analytics = state["analytics"]
+        wheel.rng, wheel.backend = state["rng"], state["backend"]
+        wheel.buffer, wheel.position = state["buffer"], state["buffer_position"]
+        self.player.__dict__.update(state["player"])
+        return state["position"], state["seed"]
+
+    def cache_key(self, seed):
+        """
+        returns the CACHE key of the run with the given master seed
+        """
+        backend = self.game.wheel.backend
+        return self.cache.key(self.player.__class__, self.player.parameters(), self.init_stake, self.game.table.limit,
+                              self.init_duration, seed, self.game.wheel.layout,
+                              None if backend is None else backend.__class__)
+
+    def converge(self, precision=0.01, z=1.96, batch=None, max_samples=None, max_seconds=None, workers=1,
+                 seed=None):
+        """
+        plays sessions in batches of BATCH (default SAMPLES) until the confidence intervals of both the maxima and
+        the duration averages are narrower than PRECISION times the average, or until MAX_SAMPLES sessions or
+        MAX_SECONDS have been spent. Z sets the confidence level, 1.96 for 95%. Seeded runs use the same sessions
+        as gather() with that seed. Reports the statistics and the number of samples it took.
+        """
+        batch = batch or self.samples
+        master = random.Random(seed) if (workers != 1 or seed is not None) else None
+        self.open_statistics()
+        maxima_stats, duration_stats = RunningStats(), RunningStats()
+        start = time.time()
+
+        while True:
+            n = batch if max_samples is None else min(batch, max_samples - maxima_stats.count)
+            if master is None:
+                seeds = itertools.repeat(None)
+                sessions = self.play_sessions(n)
+            else:
+                seeds = list( master.getrandbits(64) for i in range(n) )
+                sessions = self.gather_seeded(workers, seeds)
+            for seed, (duration, maxima, stake) in itertools.izip(seeds, sessions):
+                self.record(duration, maxima, stake, seed)
+                duration_stats.push(duration)
+                maxima_stats.push(maxima)
+
+            self.converged = all( z * stats.standard_deviation() / math.sqrt(stats.count) <= precision * abs(stats.mean)
+                                  for stats in (maxima_stats, duration_stats) )
+            if self.converged or maxima_stats.count == max_samples or \
+                    (max_seconds is not None and time.time() - start >= max_seconds):
+                break
+
+        self.samples = maxima_stats.count
+        self.report()
+        if self.analytics is not None:
+            self.analytics.report(self.player.__class__.__name__)
+        print "%s after [ %d ] samples \n\n" % ("Converged" if self.converged else "Stopped without converging",
+                                               self.samples)
+
+    def open_statistics(self):
+        """
+        starts fresh running statistics in streaming mode
+        """
+        if self.streaming:
+            self.duration_stats = RunningStats(self.quantiles)
+            self.maxima_stats = RunningStats(self.quantiles)
+
+    def record(self, duration, maxima, final_stake=None, seed=None):
+        """
+        adds the duration and maxima of a finished session to the statistics, and its record to the SINK
+        """
+        if self.sink is not None:
+            self.sink.write(self.player.__class__.__name__, seed, duration, maxima, final_stake)
+        if self.streaming:
+            self.duration_stats.push(duration)
+            self.maxima_stats.push(maxima)
+        else:
+            self.duration.append(duration)
+            self.maxima.append(maxima)
+
+    def play_sessions(self, n):
+        """
+        plays N sessions on the game's own wheel and yields (duration, maxima, final stake) for each
+        """
+        for i in range(n):
+            self.reset_player()
+            if self.analytics is None:
+                yield self.session_summary() + (self.player.stake,)
+            else:
+                yield self.analysed_session() + (self.player.stake,)
+
+    def sample_seeds(self, seed):
+        """
+        returns one RNG seed per sample, derived from the master seed
+        """
+        master = random.Random(seed)
+        return list( master.getrandbits(64) for i in range(self.samples) )
+
+    def gather_seeded(self, workers, seeds):
+        """
+        plays one session per seed on WORKERS processes and yields (duration, maxima, final stake) for each, in seed
+        order. Given ANALYTICS, each chunk of sessions comes back with its own SessionAnalytics, merged before the
+        chunk's last session is yielded.
+        """
+        chunk = max(1, min(1000, len(seeds) // (workers * 4)))
+        backend = self.game.wheel.backend
+        backend_class = None if backend is None else backend.__class__
+        jobs = ( (self.player.__class__, self.player.parameters(), self.game.table.limit, self.init_stake, self.init_duration, backend_class,
+                  self.game.wheel.layout, seeds[i:i + chunk]) for i in range(0, len(seeds), chunk) )
+        gather = _gather_sessions if self.analytics is None else _gather_analysed
+
+        pool = None if workers == 1 else multiprocessing.Pool(workers)
+        try:
+            for results in (itertools.imap if pool is None else pool.imap)(gather, jobs):
+                if self.analytics is not None:
+                    results, analytics = results
+                for result in results[:-1]:
+                    yield result
+                if self.analytics is not None:
+                    self.analytics.merge(analytics)
+                yield results[-1]
+        finally:
+            if pool is not None:
+                pool.terminate()
 
     def reset_player(self):
         self.player.set_stake(self.init_stake)
@@ -533,13 +1920,922 @@ class Simulator(object):
         return math.sqrt(float(sum(dif_sqrd)) / len(dif_sqrd))
 
     def report(self):
+        if self.streaming:
+            self.report_streaming()
+            return
         print "-%s's- \nMaxima Average: [ %f ] \nMaxima Standard Deviation: [ %f ] "  % \
               (self.player.__class__.__name__, self.get_average(self.maxima), self.standard_deviation(self.maxima))
         print "Duration Average: [ %f ] \nDuration Standard Deviation: [ %f ] " %\
               (self.get_average(self.duration), self.standard_deviation(self.duration))
+        if self.sink is not None:
+            # every session is in the sink already, don't print the lists
+            self.sink.flush()
+            print "Sessions written to: [ %s ] \n\n" % self.sink.path
+            return
         print "\nMaxima: ", self.maxima
         print "\n\nDuration: ", self.duration, "\n\n"
 
+    def report_streaming(self):
+        print "-%s's- \nMaxima Average: [ %f ] \nMaxima Standard Deviation: [ %f ] "  % \
+              (self.player.__class__.__name__, self.maxima_stats.mean, self.maxima_stats.standard_deviation())
+        print "Duration Average: [ %f ] \nDuration Standard Deviation: [ %f ] " %\
+              (self.duration_stats.mean, self.duration_stats.standard_deviation())
+        for q_maxima, q_duration in zip(self.maxima_stats.quantiles, self.duration_stats.quantiles):
+            print "Maxima %g Quantile: [ %f ] \nDuration %g Quantile: [ %f ] " % \
+                  (q_maxima.p, q_maxima.value(), q_duration.p, q_duration.value())
+        print "Samples: [ %d ] \n\n" % self.maxima_stats.count
+        if self.sink is not None:
+            self.sink.flush()
+
+
+class PairedSimulator(object):
+    """
+    PairedSimulator compares players on common random numbers: every sample draws one stream of spins from its own
+    seed and replays it to each of the PLAYERS, so the differences between them aren't swamped by each one seeing
+    different spins. Reports each player's statistics, then the paired differences from the first player.
+    """
+    def __init__(self, game, players):
+        self.init_duration = 250
+        self.init_stake = 100
+        self.samples = 50
+        self.game = game
+        self.simulators = list( Simulator(game, player) for player in players ) # keep each player's statistics
+        self.differences = [] # (maxima, duration) RunningStats of each later player minus the first
+
+    def gather(self, workers=1, seed=None):
+        """
+        plays SAMPLES sessions of every player, each sample on one stream of spins, and reports them. The first
+        player's sessions are the ones Simulator.gather plays with the same seed.
+        """
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        for sim in self.simulators:
+            sim.init_duration, sim.init_stake, sim.samples = self.init_duration, self.init_stake, self.samples
+            sim.open_statistics()
+        self.differences = list( (RunningStats(), RunningStats()) for sim in self.simulators[1:] )
+
+        seeds = self.simulators[0].sample_seeds(seed)
+        for seed, sessions in itertools.izip(seeds, self.gather_paired(workers, seeds)):
+            for sim, (duration, maxima, stake) in zip(self.simulators, sessions):
+                sim.record(duration, maxima, stake, seed)
+            first = sessions[0]
+            for (maxima_stats, duration_stats), session in zip(self.differences, sessions[1:]):
+                maxima_stats.push(session[1] - first[1])
+                duration_stats.push(session[0] - first[0])
+
+        for sim in self.simulators:
+            sim.report()
+        self.report()
+
+    def gather_paired(self, workers, seeds):
+        """
+        plays every player on one stream of spins per seed on WORKERS processes and yields their (duration, maxima,
+        final stake) for each seed, in seed order
+        """
+        chunk = max(1, min(1000, len(seeds) // (workers * 4)))
+        backend = self.game.wheel.backend
+        backend_class = None if backend is None else backend.__class__
+        players = list( (sim.player.__class__, sim.player.parameters()) for sim in self.simulators )
+        jobs = ( (players, self.game.table.limit, self.init_stake, self.init_duration, backend_class,
+                  self.game.wheel.layout, seeds[i:i + chunk]) for i in range(0, len(seeds), chunk) )
+
+        if workers == 1:
+            for results in itertools.imap(_gather_paired, jobs):
+                for result in results:
+                    yield result
+        else:
+            pool = multiprocessing.Pool(workers)
+            try:
+                for results in pool.imap(_gather_paired, jobs):
+                    for result in results:
+                        yield result
+            finally:
+                pool.terminate()
+
+    def variance_reduction(self, index, column):
+        """
+        returns how many times smaller the variance of the paired differences is than it would be for independent
+        samples, for the later player INDEX (from 1) and the column, 0 for maxima or 1 for duration
+        """
+        paired = self.differences[index - 1][column].variance()
+        independent = sum( self.column_stats(sim, column).variance() for sim in (self.simulators[0],
+                                                                                  self.simulators[index]) )
+        return independent / paired if paired else float("inf")
+
+    def column_stats(self, sim, column):
+        if sim.streaming:
+            return (sim.maxima_stats, sim.duration_stats)[column]
+        stats = RunningStats()
+        for x in (sim.maxima, sim.duration)[column]:
+            stats.push(x)
+        return stats
+
+    def report(self):
+        first = self.simulators[0].player.__class__.__name__
+        for index, (maxima_stats, duration_stats) in enumerate(self.differences, 1):
+            n = maxima_stats.count
+            print "-%s's minus %s's- " % (self.simulators[index].player.__class__.__name__, first)
+            print "Maxima Difference Average: [ %f ] \nMaxima Difference Standard Error: [ %f ] " % \
+                  (maxima_stats.mean, maxima_stats.standard_deviation() / math.sqrt(n))
+            print "Duration Difference Average: [ %f ] \nDuration Difference Standard Error: [ %f ] " % \
+                  (duration_stats.mean, duration_stats.standard_deviation() / math.sqrt(n))
+            print "Variance Reduction: Maxima [ %f ] Duration [ %f ] \n\n" % \
+                  (self.variance_reduction(index, 0), self.variance_reduction(index, 1))
+
+
+class TableSimulator(object):
+    """
+    TableSimulator seats all the PLAYERS at the game's one table and plays their sessions together, one spin per
+    round for the whole table, until every one of them is out of rounds or stake. The sessions of the players of
+    each class are gathered by a Simulator of that class, which reports them.
+    """
+    def __init__(self, game, players):
+        self.init_duration = 250
+        self.init_stake = 100
+        self.samples = 50
+        self.game = game
+        self.players = players
+        self.simulators = collections.OrderedDict() # player class name : Simulator of its seats' sessions
+        for player in players:
+            self.simulators.setdefault(player.__class__.__name__, Simulator(game, player))
+
+    def gather(self, workers=1, seed=None):
+        """
+        plays SAMPLES table sessions and reports each player class. Given a seed or more than one worker, every
+        table session gets its own RNG stream derived from the master seed, as in Simulator.gather.
+        """
+        for sim in self.simulators.values():
+            sim.init_duration, sim.init_stake, sim.samples = self.init_duration, self.init_stake, self.samples
+            sim.open_statistics()
+
+        if workers == 1 and seed is None:
+            seeds = itertools.repeat(None)
+            sessions = ( self.session_summary() for i in range(self.samples) )
+        else:
+            if seed is None:
+                seed = random.getrandbits(64)
+            self.seed = seed
+            seeds = self.simulators.values()[0].sample_seeds(seed)
+            sessions = self.gather_table(workers, seeds)
+
+        for seed, results in itertools.izip(seeds, sessions):
+            for player, (duration, maxima, stake) in zip(self.players, results):
+                self.simulators[player.__class__.__name__].record(duration, maxima, stake, seed)
+
+        for sim in self.simulators.values():
+            sim.report()
+
+    def session_summary(self):
+        """
+        plays one table session from the start and returns every player's (duration, maxima, final stake)
+        """
+        players = self.players
+        for player in players:
+            player.set_stake(self.init_stake)
+            player.set_rounds(self.init_duration)
+            player.reset_class_defaults()
+        return _table_session(self.game, players)
+
+    def gather_table(self, workers, seeds):
+        """
+        plays one table session per seed on WORKERS processes and yields the players' (duration, maxima, final
+        stake) for each, in seed order
+        """
+        chunk = max(1, min(1000, len(seeds) // (workers * 4)))
+        backend = self.game.wheel.backend
+        backend_class = None if backend is None else backend.__class__
+        players = list( (player.__class__, player.parameters()) for player in self.players )
+        jobs = ( (players, self.game.table.limit, self.init_stake, self.init_duration, backend_class,
+                  self.game.wheel.layout, seeds[i:i + chunk]) for i in range(0, len(seeds), chunk) )
+
+        if workers == 1:
+            for results in itertools.imap(_gather_table, jobs):
+                for result in results:
+                    yield result
+        else:
+            pool = multiprocessing.Pool(workers)
+            try:
+                for results in pool.imap(_gather_table, jobs):
+                    for result in results:
+                        yield result
+            finally:
+                pool.terminate()
+
+
+class ImportanceSimulator(Simulator):
+    """
+    ImportanceSimulator estimates the statistics of sessions that are too rare to sample plainly, like a Martingale
+    losing its stake. The wheel spins from a TiltedRandom that makes the bins OUTCOME wins on come up with
+    PROBABILITY in all instead of their fair share, and every session is weighted by its likelihood ratio, so the
+    weighted averages are unbiased estimates of the untilted ones. Each estimate is reported with its standard
+    error, along with the effective number of samples the weights are worth.
+    Tilting every spin of a long session spreads the weights out until few samples count, so WHEN can restrict it
+    to the spins where the rare event is building up: WHEN(player) is asked before each spin.
+    """
+    def __init__(self, game, player, outcome="Black", probability=0.3, threshold=None, when=None):
+        Simulator.__init__(self, game, player)
+        self.outcome = outcome
+        self.probability = probability
+        self.threshold = threshold # optional maxima to estimate the chance of reaching
+        self.when = when
+        self.weights = None
+        self.ruin = None
+        self.weighted_maxima = None
+        self.weighted_duration = None
+        self.exceeded = None
+
+    def gather(self, seed=None):
+        """
+        plays SAMPLES tilted sessions on the game's wheel and reports the weighted estimates
+        """
+        wheel = self.game.wheel
+        if wheel.backend is not None:
+            raise ValueError("ImportanceSimulator spins the wheel's rng, not a backend")
+        rng = TiltedRandom(seed)
+        rng.tilt(self.weights_for(wheel))
+        if self.when is not None:
+            rng.condition = lambda: self.when(self.player)
+
+        self.open_statistics()
+        self.weights, self.ruin = RunningStats(), RunningStats()
+        self.weighted_maxima, self.weighted_duration, self.exceeded = RunningStats(), RunningStats(), RunningStats()
+        wheel.rng, previous = rng, wheel.rng
+        try:
+            for i in range(self.samples):
+                self.reset_player()
+                rng.likelihood = 1.0
+                duration, maxima = self.session_summary()
+                w = rng.likelihood
+                self.record(duration, maxima, self.player.stake)
+                self.weights.push(w)
+                self.ruin.push(w * (self.player.stake == 0))
+                self.weighted_maxima.push(w * maxima)
+                self.weighted_duration.push(w * duration)
+                if self.threshold is not None:
+                    self.exceeded.push(w * (maxima >= self.threshold))
+        finally:
+            wheel.rng = previous
+        self.report()
+
+    def weights_for(self, wheel):
+        """
+        returns the tilted weight of each BIN: PROBABILITY shared by the bins OUTCOME wins on, the rest by the others
+        """
+        winning = wheel.get_bins(self.outcome)
+        if not 0 < self.probability < 1 or not 0 < len(winning) < len(wheel.bins):
+            raise ValueError("can't tilt %s to %f" % (self.outcome, self.probability))
+        return list( self.probability / len(winning) if i in winning else
+                     (1 - self.probability) / (len(wheel.bins) - len(winning)) for i in range(len(wheel.bins)) )
+
+    def estimate(self, stats):
+        """
+        returns the weighted estimate and its standard error
+        """
+        return stats.mean, stats.standard_deviation() / math.sqrt(stats.count)
+
+    def effective_samples(self):
+        """
+        returns the number of plain samples the weighted ones are worth, (sum w)^2 / sum w^2
+        """
+        n = self.weights.count
+        return (n * self.weights.mean) ** 2 / (n * (self.weights.variance() + self.weights.mean ** 2))
+
+    def report(self):
+        print "-%s's- (%s tilted to %f) " % (self.player.__class__.__name__, self.outcome, self.probability)
+        print "Ruin Probability: [ %f ] \nRuin Probability Standard Error: [ %f ] " % self.estimate(self.ruin)
+        print "Maxima Average: [ %f ] \nMaxima Average Standard Error: [ %f ] " % self.estimate(self.weighted_maxima)
+        print "Duration Average: [ %f ] \nDuration Average Standard Error: [ %f ] " % \
+              self.estimate(self.weighted_duration)
+        if self.threshold is not None:
+            print "Maxima >= %d Probability: [ %f ] \nMaxima >= %d Probability Standard Error: [ %f ] " % \
+                  ((self.threshold,) + self.estimate(self.exceeded)[:1] + (self.threshold,) +
+                   self.estimate(self.exceeded)[1:])
+        print "Effective Samples: [ %f ] of [ %d ] \n\n" % (self.effective_samples(), self.weights.count)
+
+
+class SkipAheadSimulator(Simulator):
+    """
+    SkipAheadSimulator plays the same sessions as Simulator in distribution, without spinning the wheel one cycle
+    at a time. Martingale, SevenReds and Passenger57 all bet on one outcome, so the length of the next run of losses
+    or of reds is drawn straight from its geometric distribution and the whole run is applied at once: the stake
+    change, the table limit and the rounds it takes. A Martingale run of k losses costs BASE_WAGER * (2**k - 1),
+    so only a bet capped by the stake or the limit takes a spin of its own. Spins the player can't bet on, like
+    SevenReds waiting for its streak or a Martingale whose doubled bet is over the limit, are skipped in one step
+    too. Other players are played spin by spin.
+    """
+    def __init__(self, game, player, seed=None):
+        Simulator.__init__(self, game, player)
+        self.rng = random.Random(seed)
+        self.engines = {Martingale: self.martingale_session, SevenReds: self.seven_reds_session,
+                        Passenger57: self.passenger57_session}
+
+    def gather(self, seed=None):
+        """
+        plays SAMPLES sessions and reports their statistics, seeding the run's generator if given a seed
+        """
+        if seed is not None:
+            self.rng.seed(seed)
+        self.open_statistics()
+        for duration, maxima, stake in self.play_sessions(self.samples):
+            self.record(duration, maxima, stake)
+        self.report()
+
+    def session_summary(self):
+        engine = self.engines.get(type(self.player))
+        if engine is None:
+            return Simulator.session_summary(self)
+        return engine()
+
+    def probability(self, name):
+        """
+        returns the chance the OUTCOME with the given name wins a spin
+        """
+        wheel = self.game.wheel
+        return len(wheel.get_bins(name)) / float(len(wheel.bins))
+
+    def geometric(self, p):
+        """
+        returns the number of failures before the first success of a trial that succeeds with probability P
+        """
+        if p >= 1:
+            return 0
+        return int(math.log(1.0 - self.rng.random()) / math.log(1.0 - p))
+
+    def passenger57_session(self):
+        player = self.player
+        stake, rounds = player.stake, player.rounds_to_go
+        odds = self.game.wheel.odds[player.bet.outcome.name] # what the wheel pays, as RouletteGame does
+        p = self.probability(player.bet.outcome.name)
+        duration, maxima = 0, None
+        if player.bet.amount > self.game.table.limit and rounds != 0 and stake != 0:
+            # the bet is never valid, the stake stays put for the whole session
+            duration, rounds, maxima = rounds, 0, stake
+
+        while rounds != 0 and stake != 0:
+            # a run of losses of the bet of 1, cut short by the rounds or the stake running out
+            losses = self.geometric(p)
+            run = min(losses, rounds, stake)
+            if run:
+                if maxima is None or stake - 1 > maxima:
+                    maxima = stake - 1
+                stake -= run
+                rounds -= run
+                duration += run
+            if run == losses and rounds != 0 and stake != 0:
+                stake += odds
+                rounds -= 1
+                duration += 1
+                if maxima is None or stake > maxima:
+                    maxima = stake
+
+        player.stake, player.rounds_to_go = stake, rounds
+        return duration, maxima
+
+    def martingale_session(self):
+        player = self.player
+        stake, rounds, loss_count = player.stake, player.rounds_to_go, player.loss_count
+        limit, odds = self.game.table.limit, self.game.wheel.odds[player.black.name]
+        p = self.probability(player.black.name)
+        duration, maxima = 0, None
+        losses = None # losses left in the current run
+
+        while rounds != 0 and stake != 0:
+            amount = min(player.base_wager * 2**loss_count, stake)
+            if amount > limit:
+                # nothing changes any more, the rest of the rounds pass without a bet
+                duration += rounds
+                rounds = 0
+                if maxima is None or stake > maxima:
+                    maxima = stake
+                break
+            if losses is None:
+                losses = self.geometric(p)
+            if losses:
+                # lose as many full doubling bets as the run, the rounds, the table limit and the stake allow at once
+                unit = player.base_wager * 2**loss_count
+                run = min(losses, rounds, int(limit // unit).bit_length(), int(stake // unit + 1).bit_length() - 1)
+                if run:
+                    if maxima is None or stake - unit > maxima:
+                        maxima = stake - unit # the stake only falls after the first loss
+                    stake -= unit * (2**run - 1)
+                    losses -= run
+                    loss_count += run
+                    rounds -= run
+                    duration += run
+                    continue
+                # a bet capped by the stake, spun on its own
+                losses -= 1
+                stake -= amount
+                loss_count += 1
+            else:
+                losses = None
+                stake += amount * odds
+                loss_count = 0
+            rounds -= 1
+            duration += 1
+            if maxima is None or stake > maxima:
+                maxima = stake
+
+        player.stake, player.rounds_to_go, player.loss_count = stake, rounds, loss_count
+        return duration, maxima
+
+    def seven_reds_session(self):
+        player = self.player
+        stake, rounds, loss_count, red_count = player.stake, player.rounds_to_go, player.loss_count, player.redCount
+        limit, odds = self.game.table.limit, self.game.wheel.odds[player.black.name]
+        p_black, p_red = self.probability(player.black.name), self.probability(player.red.name)
+        duration, maxima = 0, None
+
+        while rounds != 0 and stake != 0:
+            if red_count:
+                # wait for the streak: a run of reds, then the spin that breaks it unless the run is long enough
+                reds = self.geometric(1 - p_red)
+                if min(reds, red_count) >= rounds:
+                    spins = rounds
+                    red_count -= rounds
+                elif reds >= red_count:
+                    spins = red_count
+                    red_count = 0
+                else:
+                    spins = reds + 1
+                    red_count = 7
+                rounds -= spins
+                duration += spins
+                if maxima is None or stake > maxima:
+                    maxima = stake
+                continue
+
+            # the streak is complete, this spin is bet on unless the bet is over the limit
+            amount = min(player.base_wager * 2**loss_count, stake)
+            u = self.rng.random()
+            if amount <= limit:
+                if u < p_black:
+                    stake += amount * odds
+                    loss_count = 0
+                else:
+                    stake -= amount
+                    loss_count += 1
+            red_count = 6 if p_black <= u < p_black + p_red else 7
+            rounds -= 1
+            duration += 1
+            if maxima is None or stake > maxima:
+                maxima = stake
+
+        player.stake, player.rounds_to_go, player.loss_count, player.redCount = stake, rounds, loss_count, red_count
+        return duration, maxima
+
+
+class MarkovEvaluator(object):
+    """
+    MarkovEvaluator computes the exact session statistics Simulator estimates by sampling, for Martingale, SevenReds
+    and Passenger57. A session of these players is a finite Markov chain over (stake, loss count, red count) driven
+    by the bin probabilities of the WHEEL, so the distributions of duration and maxima and the ruin probability can be
+    found by pushing probability forward one cycle at a time. Transitions of a state are memoized.
+    Subclasses of PLAYERS may play differently, so only these exact classes are evaluated.
+    """
+    players = (Martingale, SevenReds, Passenger57)
+
+    def __init__(self, game, player):
+        if type(player) not in MarkovEvaluator.players:
+            raise TypeError("MarkovEvaluator can't evaluate %s" % player.__class__.__name__)
+        self.init_duration = 250 # cycles that a player
+        self.init_stake = 100
+        self.player = player
+        self.game = game
+        self.tolerance = 0.0 # sessions still going with less probability than this are dropped
+        self.transitions = {} # (stake, loss_count, redCount) : [(probability, next state)]
+        self.duration = {} # duration : probability
+        self.maxima = {} # maxima : probability
+        self.ruin = [] # probability of going broke on each cycle
+
+    def spin_probabilities(self):
+        """
+        returns {(black wins, red wins): probability} for the WHEEL
+        """
+        wheel = self.game.wheel
+        black, red = wheel.get_bins("Black"), wheel.get_bins("Red")
+        probabilities = collections.defaultdict(float)
+        for number in range(len(wheel.bins)):
+            probabilities[(number in black, number in red)] += 1.0 / len(wheel.bins)
+        return probabilities.items()
+
+    def transition(self, state):
+        """
+        returns the [(probability, next state)] of one cycle from the given state, or None when the player's next
+        bet is over the table limit: the stake can't change any more and the session plays out unchanged
+        """
+        if state in self.transitions:
+            return self.transitions[state]
+        stake, loss_count, red_count = state
+        martingale = isinstance(self.player, Martingale)
+        seven_reds = isinstance(self.player, SevenReds)
+
+        playing = True
+        if seven_reds:
+            playing = red_count == 0
+            if playing:
+                red_count = 7
+        amount = None
+        if playing:
+            amount = min(self.base_wager * 2**loss_count, stake) if martingale else 1
+            if amount > self.game.table.limit:
+                self.transitions[state] = None
+                return None
+
+        next_states = collections.defaultdict(float)
+        for (black, red), probability in self.spins:
+            s, l, r = stake, loss_count, red_count
+            if amount is not None:
+                if black:
+                    s += amount * self.odds
+                    l = 0
+                else:
+                    s -= amount
+                    l += 1 if martingale else 0
+            if seven_reds:
+                r = r - 1 if red else 7
+            next_states[(s, l, r)] += probability
+        self.transitions[state] = list( (p, n) for n, p in next_states.items() )
+        return self.transitions[state]
+
+    def evaluate(self):
+        """
+        computes the distributions of duration and maxima and the probability of ruin on each cycle
+        """
+        self.player.reset_class_defaults()
+        self.base_wager = getattr(self.player, "base_wager", 1)
+        self.odds = self.game.wheel.get_outcome("Black").odds
+        self.spins = self.spin_probabilities()
+        self.transitions = {}
+        self.duration = collections.defaultdict(float)
+        self.maxima = collections.defaultdict(float)
+        self.ruin = [0.0] * self.init_duration
+
+        # (stake, loss_count, redCount) : {maxima so far : probability}, for the sessions still going
+        states = {(self.init_stake, 0, 7): {None: 1.0}}
+        transitions, duration, maxima_dist = self.transitions, self.duration, self.maxima
+        for t in range(1, self.init_duration + 1):
+            last = t == self.init_duration
+            going = {}
+            for state, maxima in states.iteritems():
+                next_states = transitions[state] if state in transitions else self.transition(state)
+                total = sum(maxima.itervalues())
+                if next_states is None:
+                    # the stake can't change any more, the session plays out unchanged
+                    duration[self.init_duration] += total
+                    for m, p in maxima.iteritems():
+                        maxima_dist[state[0] if m is None or state[0] > m else m] += p
+                    continue
+                for q, next_state in next_states:
+                    s = next_state[0]
+                    if s == 0 or last:
+                        duration[t] += q * total
+                        if s == 0:
+                            self.ruin[t - 1] += q * total
+                        for m, p in maxima.iteritems():
+                            maxima_dist[s if m is None or s > m else m] += q * p
+                        continue
+                    going_maxima = going.get(next_state)
+                    if going_maxima is None:
+                        going_maxima = going[next_state] = {}
+                    below = 0.0 # sessions whose maxima becomes s
+                    for m, p in maxima.iteritems():
+                        if m is None or s >= m:
+                            below += p
+                        else:
+                            going_maxima[m] = going_maxima.get(m, 0.0) + q * p
+                    if below:
+                        going_maxima[s] = going_maxima.get(s, 0.0) + q * below
+            states = going
+            if self.tolerance:
+                for maxima in states.itervalues():
+                    for m in list( m for m, p in maxima.iteritems() if p < self.tolerance ):
+                        del maxima[m]
+        return self
+
+    def ruin_probability(self):
+        return sum(self.ruin)
+
+    def ruin_by_round(self):
+        """
+        returns the probability of having gone broke by the end of each cycle
+        """
+        by_round = []
+        total = 0.0
+        for p in self.ruin:
+            total += p
+            by_round.append(total)
+        return by_round
+
+    def get_average(self, D):
+        return sum( x * p for x, p in D.items() )
+
+    def standard_deviation(self, D):
+        _avg = self.get_average(D)
+        return math.sqrt(sum( p * (x - _avg)**2 for x, p in D.items() ))
+
+    def report(self):
+        print "-%s's- (exact) \nMaxima Average: [ %f ] \nMaxima Standard Deviation: [ %f ] "  % \
+              (self.player.__class__.__name__, self.get_average(self.maxima), self.standard_deviation(self.maxima))
+        print "Duration Average: [ %f ] \nDuration Standard Deviation: [ %f ] " %\
+              (self.get_average(self.duration), self.standard_deviation(self.duration))
+        print "Ruin Probability: [ %f ] \n\n" % self.ruin_probability()
+
+
+_worker_wheels = {} # (backend class, compiled layout) : Wheel, kept by each worker process
+
+
+def _gather_sessions(job):
+    """
+    plays one session per seed with a Table and player of its own, on a Wheel the worker process keeps between
+    jobs. Runs in the Simulator worker processes.
+    """
+    player_class, parameters, limit, stake, rounds, backend_class, layout, seeds = job
+    wheel = _worker_wheel(backend_class, layout)
+    wheel.block_size = rounds # a session never spins more than ROUNDS times
+    table = Table(limit=limit)
+    sim = Simulator(RouletteGame(wheel, table), None)
+    sim.init_stake = stake
+    sim.init_duration = rounds
+
+    results = []
+    for seed in seeds:
+        wheel.seed(seed)
+        sim.player = player_class(table=table, stake=stake, rounds_to_go=rounds, **parameters)
+        sim.reset_player()
+        results.append(sim.session_summary() + (sim.player.stake,))
+    return results
+
+
+def _gather_analysed(job):
+    """
+    plays the sessions of a _gather_sessions job into a SessionAnalytics of their own and returns their results with
+    it. Runs in the Simulator worker processes.
+    """
+    player_class, parameters, limit, stake, rounds, backend_class, layout, seeds = job
+    wheel = _worker_wheel(backend_class, layout)
+    wheel.block_size = rounds
+    table = Table(limit=limit)
+    sim = Simulator(RouletteGame(wheel, table), None)
+    sim.init_stake = stake
+    sim.init_duration = rounds
+    sim.analytics = SessionAnalytics(rounds)
+
+    results = []
+    for seed in seeds:
+        wheel.seed(seed)
+        sim.player = player_class(table=table, stake=stake, rounds_to_go=rounds, **parameters)
+        sim.reset_player()
+        results.append(sim.analysed_session() + (sim.player.stake,))
+    return results, sim.analytics
+
+
+def _gather_paired(job):
+    """
+    plays every player's session on the same stream of spins for each seed. Runs in the PairedSimulator worker
+    processes.
+    """
+    players, limit, stake, rounds, backend_class, layout, seeds = job
+    wheel = _worker_wheel(backend_class, layout)
+    wheel.block_size = rounds
+    table = Table(limit=limit)
+    sim = Simulator(RouletteGame(wheel, table), None)
+    sim.init_stake = stake
+    sim.init_duration = rounds
+
+    results = []
+    for seed in seeds:
+        wheel.seed(seed)
+        spins = wheel.draw(rounds) # a session never spins more than ROUNDS times
+        sessions = []
+        for player_class, parameters in players:
+            wheel.replay(spins)
+            sim.player = player_class(table=table, stake=stake, rounds_to_go=rounds, **parameters)
+            sim.reset_player()
+            sessions.append(sim.session_summary() + (sim.player.stake,))
+        results.append(sessions)
+    return results
+
+
+def _gather_table(job):
+    """
+    plays one session of all the players at one table per seed. Runs in the TableSimulator worker processes.
+    """
+    players, limit, stake, rounds, backend_class, layout, seeds = job
+    wheel = _worker_wheel(backend_class, layout)
+    wheel.block_size = rounds
+    table = Table(limit=limit)
+    game = RouletteGame(wheel, table)
+
+    results = []
+    for seed in seeds:
+        wheel.seed(seed)
+        seated = list( player_class(table=table, stake=stake, rounds_to_go=rounds, **parameters)
+                       for player_class, parameters in players )
+        for player in seated:
+            player.reset_class_defaults()
+        results.append(_table_session(game, seated))
+    return results
+
+
+def _table_session(game, players):
+    """
+    plays the PLAYERS at GAME's table until none of them has rounds or stake left, and returns their (duration,
+    maxima, final stake)
+    """
+    duration = [0] * len(players)
+    maxima = [None] * len(players)
+    seats = range(len(players))
+    while True:
+        seats = list( i for i in seats if players[i].rounds_to_go != 0 and players[i].stake != 0 )
+        if not seats:
+            break
+        game.cycle_all(list( players[i] for i in seats ))
+        for i in seats:
+            duration[i] += 1
+            if maxima[i] is None or players[i].stake > maxima[i]:
+                maxima[i] = players[i].stake
+    return list( (duration[i], maxima[i], players[i].stake) for i in range(len(players)) )
+
+
+def _worker_wheel(backend_class, layout):
+    """
+    returns the Wheel the worker process keeps for the backend class and layout, building it on first use
+    """
+    key = (backend_class, None if layout is None else layout.dumps())
+    wheel = _worker_wheels.get(key)
+    if wheel is None:
+        wheel = _worker_wheels[key] = Wheel(backend=None if backend_class is None else backend_class())
+        if layout is None:
+            BinBuilder().build_bins(wheel)
+        else:
+            layout.build(wheel)
+    return wheel
+
+
+class StrategyMachine(object):
+    """
+    StrategyMachine declares a betting strategy as a small state machine BatchSimulator can run on arrays: integer
+    state variables with their initial values, the OUTCOME bet on, the size of the bet and the transitions on a
+    win, a loss and each spin of the WATCHES outcomes. Every method takes the state as a dict of numpy arrays, one
+    entry per session, and updates it in place where MASK is True. The base class bets 1 on Black every spin, like
+    Passenger57.
+    """
+    outcome = "Black"
+    watches = ()
+
+    def initial(self):
+        """
+        returns the state variables and their values at the start of a session
+        """
+        return {}
+
+    def playing(self, state):
+        """
+        returns the mask of the sessions that bet this spin
+        """
+        return True
+
+    def place(self, state, mask):
+        """
+        updates the sessions that are placing a bet
+        """
+        pass
+
+    def amount(self, state):
+        """
+        returns the amount each session would bet, before the stake and table limit are applied
+        """
+        return 1
+
+    def win(self, state, mask):
+        pass
+
+    def lose(self, state, mask):
+        pass
+
+    def spin(self, state, mask, watched):
+        """
+        updates the sessions in play with the spin, WATCHED maps each watched outcome name to whether it won
+        """
+        pass
+
+
+class MartingaleMachine(StrategyMachine):
+    """
+    Martingale as a StrategyMachine: doubles the bet on Black after every loss
+    """
+    def __init__(self, base_wager=1):
+        self.base_wager = base_wager
+
+    def initial(self):
+        return {"loss_count": 0}
+
+    def amount(self, state):
+        return self.base_wager << numpy.minimum(state["loss_count"], 62)
+
+    def win(self, state, mask):
+        state["loss_count"][mask] = 0
+
+    def lose(self, state, mask):
+        state["loss_count"][mask] += 1
+
+
+class SevenRedsMachine(MartingaleMachine):
+    """
+    SevenReds as a StrategyMachine: a Martingale that only bets after 7 reds in a row
+    """
+    watches = ("Red",)
+
+    def initial(self):
+        return {"loss_count": 0, "red_count": 7}
+
+    def playing(self, state):
+        return state["red_count"] == 0
+
+    def place(self, state, mask):
+        state["red_count"][mask] = 7
+
+    def spin(self, state, mask, watched):
+        red_count = state["red_count"]
+        state["red_count"] = numpy.where(mask, numpy.where(watched["Red"], red_count - 1, 7), red_count)
+
+
+class BatchSimulator(Simulator):
+    """
+    BatchSimulator runs the same sessions as Simulator for any player with a StrategyMachine, but advances thousands
+    of them together as NumPy arrays. Spins are drawn in blocks and the stake, rounds to go and machine state of every
+    session are updated with masked array operations. Requires numpy.
+    """
+    def __init__(self, game, player, seed=None):
+        if numpy is None:
+            raise ImportError("BatchSimulator requires numpy")
+        machine = vars(type(player)).get("machine")
+        if machine is None or machine(player) is None:
+            raise TypeError("BatchSimulator can't run %s" % player.__class__.__name__)
+        Simulator.__init__(self, game, player)
+        self.batch = 100000 # sessions advanced together
+        self.block = 64 # spins drawn per session at a time
+        self.rng = numpy.random.RandomState(seed)
+
+    def gather(self):
+        self.open_statistics()
+        for start in range(0, self.samples, self.batch):
+            duration, maxima, stake = self.run_batch(min(self.batch, self.samples - start))
+            for d, m, s in zip(duration.tolist(), maxima.tolist(), stake.tolist()):
+                self.record(d, m, s)
+        self.report()
+
+    def run_batch(self, n):
+        """
+        plays n sessions to the end and returns their duration, maxima and final stake arrays
+        """
+        wheel = self.game.wheel
+        machine = self.player.machine()
+        winners = self.bin_mask(machine.outcome)
+        watches = dict( (name, self.bin_mask(name)) for name in machine.watches )
+        odds = wheel.get_outcome(machine.outcome).odds
+        limit = self.game.table.limit
+
+        stake = numpy.full(n, self.init_stake, dtype=numpy.int64)
+        rounds = numpy.full(n, self.init_duration, dtype=numpy.int64)
+        state = dict( (name, numpy.full(n, value, dtype=numpy.int64)) for name, value in machine.initial().items() )
+        duration = numpy.zeros(n, dtype=numpy.int64)
+        maxima = numpy.full(n, -1, dtype=numpy.int64)
+        active = (rounds != 0) & (stake != 0)
+
+        while active.any():
+            for spin in self.rng.randint(0, len(wheel.bins), size=(self.block, n)):
+                playing = active & machine.playing(state)
+                machine.place(state, playing)
+
+                amount = numpy.minimum(machine.amount(state), stake)
+                bet = playing & (amount <= limit)
+                won = bet & winners[spin]
+                lost = bet & ~winners[spin]
+                stake -= numpy.where(bet, amount, 0)
+                stake += numpy.where(won, amount * (odds + 1), 0)
+                machine.win(state, won)
+                machine.lose(state, lost)
+
+                machine.spin(state, active, dict( (name, mask[spin]) for name, mask in watches.items() ))
+                rounds[active] -= 1
+                duration[active] += 1
+                maxima = numpy.where(active, numpy.maximum(maxima, stake), maxima)
+                active &= (rounds != 0) & (stake != 0)
+                if not active.any():
+                    break
+        return duration, maxima, stake
+
+    def bin_mask(self, name):
+        """
+        returns a bool array of the BINs the OUTCOME with the given name wins on, by bin number
+        """
+        mask = numpy.zeros(len(self.game.wheel.bins), dtype=bool)
+        mask[list(self.game.wheel.get_bins(name))] = True
+        return mask
+
 
 class RunGame(object):
     def __init__(self):
@@ -547,28 +2843,169 @@ class RunGame(object):
         parser.add_argument('-s', '--stake', help='Initial player stake', default=100, type=int, required=False)
         parser.add_argument('-r', '--rounds', help='Rounds to conduct', default=100, type=int, required=False)
         parser.add_argument('-l', '--limit', help='Table bet limit', default=100, type=int, required=False)
+        parser.add_argument('-w', '--workers', help='Worker processes', default=1, type=int, required=False)
+        parser.add_argument('--seed', help='Master seed for reproducible runs', default=None, type=int, required=False)
+        parser.add_argument('--stream', help='Keep constant memory statistics instead of every sample',
+                            action='store_true')
+        parser.add_argument('-q', '--quantiles', help='Quantiles to sketch when streaming', nargs='*', default=[],
+                            type=float, required=False)
+        parser.add_argument('--exact', help='Compute the exact statistics instead of sampling', action='store_true')
+        parser.add_argument('-p', '--precision', help='Sample until the confidence intervals are narrower than this '
+                            'fraction of the averages', default=None, type=float, required=False)
+        parser.add_argument('--max-samples', help='Sample budget when sampling to a precision', default=None,
+                            type=int, required=False)
+        parser.add_argument('--max-seconds', help='Time budget when sampling to a precision', default=None,
+                            type=float, required=False)
+        parser.add_argument('--rng', help='Random number generator backend for the wheel', default=None,
+                            choices=sorted(BACKENDS), required=False)
+        parser.add_argument('--layout', help='Wheel layout: american, european or a layout file', default='american',
+                            required=False)
+        parser.add_argument('-o', '--output', help='Directory every session is written to as .npy columns',
+                            default=None, required=False)
+        parser.add_argument('--profile', help='Time each phase of the game and report it. Plays every session on '
+                            'one process, so it needs one worker and no --seed or --crn', action='store_true')
+        parser.add_argument('--payouts', help='Settle bets with a payout matrix compiled from the wheel. Plays every '
+                            'session on one process, so it needs one worker and no --seed or --crn',
+                            action='store_true')
+        parser.add_argument('--player', help='Strategies to play, by registered name', nargs='+',
+                            default=['martingale', 'sevenreds'], required=False)
+        parser.add_argument('--plugin', help='Module to import before looking up the strategies, it registers its '
+                            'own with register_strategy', action='append', default=[], required=False)
+        parser.add_argument('--tilt', help='Importance sample with the bins OUTCOME wins on coming up with '
+                            'PROBABILITY, and report weighted estimates', nargs=2, metavar=('OUTCOME', 'PROBABILITY'),
+                            default=None, required=False)
+        parser.add_argument('--tilt-streak', help='Only tilt once a player has lost this many bets in a row',
+                            default=None, type=int, required=False)
+        parser.add_argument('--threshold', help='Maxima whose probability of being reached is estimated when tilting',
+                            default=None, type=int, required=False)
+        parser.add_argument('--skip-ahead', help='Draw whole runs of losses at once instead of playing every spin. '
+                            'Plays on one process', action='store_true')
+        parser.add_argument('--cache', help='Directory seeded runs are cached in, reruns only play the sessions '
+                            'that are missing', default=None, required=False)
+        parser.add_argument('--checkpoint', help='Save the progress of each player\'s run to this path plus the '
+                            'player\'s name', default=None, required=False)
+        parser.add_argument('--resume', help='Carry on from the --checkpoint files', action='store_true')
+        parser.add_argument('--seats', help='Seat this many of each player at one table and play them together',
+                            default=None, type=int, required=False)
+        parser.add_argument('--crn', help='Play the players on common random numbers and report their paired '
+                            'differences', action='store_true')
+        parser.add_argument('--analytics', help='Report percentiles, drawdowns, stake bands and the probability of '
+                            'ruin by round', action='store_true')
         args = parser.parse_args()
-
-        wheel = Wheel()
+        if args.profile and (args.workers != 1 or args.seed is not None or args.crn):
+            parser.error("--profile needs one worker and no --seed or --crn")
+        if args.payouts and (args.workers != 1 or args.seed is not None or args.crn):
+            parser.error("--payouts needs one worker and no --seed or --crn")
+        if args.analytics and (args.tilt or args.crn or args.seats or args.skip_ahead or args.exact):
+            parser.error("--analytics can't be used with --tilt, --crn, --seats, --skip-ahead or --exact")
+        if args.checkpoint is not None and (args.precision is not None or args.tilt or args.crn or args.seats or
+                                            args.skip_ahead or args.exact):
+            parser.error("--checkpoint can't be used with --precision, --tilt, --crn, --seats, --skip-ahead or "
+                         "--exact")
+        if args.resume and args.checkpoint is None:
+            parser.error("--resume needs --checkpoint")
+        if args.tilt is not None and args.rng is not None:
+            parser.error("--tilt spins the wheel's own generator and can't be used with --rng")
+        for module in args.plugin:
+            importlib.import_module(module)
+        unknown = list( name for name in args.player if name.lower() not in STRATEGIES )
+        if unknown:
+            parser.error("unknown strategy %s, choose from %s" % (", ".join(unknown), ", ".join(sorted(STRATEGIES))))
+        player_classes = list( STRATEGIES[name.lower()] for name in args.player )
+        unsupported = list( c.__name__ for c in player_classes if c not in MarkovEvaluator.players )
+        if args.exact and unsupported:
+            parser.error("--exact can't evaluate %s, only %s" %
+                         (", ".join(unsupported), ", ".join( c.__name__ for c in MarkovEvaluator.players )))
+
+        wheel = Wheel(backend=None if args.rng is None else BACKENDS[args.rng]())
         self.table = Table(limit=args.limit)
-        bin_builder = BinBuilder()
+        bin_builder = BinBuilder(layout=args.layout)
         bin_builder.build_bins(wheel)
         self.game = RouletteGame(wheel, self.table)
+        if args.profile:
+            self.game.profiler = Profiler()
+        if args.payouts:
+            self.game.payouts = bin_builder.build_payouts(wheel)
 
         print 'Starting Stake: (%d) - Rounds: (%d) - Table Limit: (%d) \n' % \
               (args.stake, args.rounds, args.limit)
 
-        _martin = Martingale(table=self.table, stake=args.stake, rounds_to_go=args.rounds)
-        sim = Simulator(self.game, _martin)
-        sim.gather()
-
-        _7R = SevenReds(table=self.table, stake=args.stake, rounds_to_go=args.rounds)
-        sim = Simulator(self.game, _7R)
-        sim.gather()
+        if args.exact:
+            for player_class in player_classes:
+                _player = player_class(table=self.table, stake=args.stake, rounds_to_go=args.rounds)
+                MarkovEvaluator(self.game, _player).evaluate().report()
+            return
+
+        self.sink = None if args.output is None else ResultSink(args.output)
+
+        if args.tilt is not None:
+            outcome, probability = args.tilt[0], float(args.tilt[1])
+            when = None if args.tilt_streak is None else \
+                (lambda player: getattr(player, "loss_count", 0) >= args.tilt_streak)
+            for player_class in player_classes:
+                _player = player_class(table=self.table, stake=args.stake, rounds_to_go=args.rounds)
+                sim = ImportanceSimulator(self.game, _player, outcome, probability, args.threshold, when)
+                sim.sink = self.sink
+                sim.gather(seed=args.seed)
+            if self.sink is not None:
+                self.sink.close()
+            return
+
+        if args.crn:
+            players = list( player_class(table=self.table, stake=args.stake, rounds_to_go=args.rounds)
+                            for player_class in player_classes )
+            paired = PairedSimulator(self.game, players)
+            for sim in paired.simulators:
+                sim.streaming, sim.quantiles, sim.sink = args.stream, args.quantiles, self.sink
+            paired.gather(workers=args.workers, seed=args.seed)
+            if self.sink is not None:
+                self.sink.close()
+            return
+
+        if args.seats is not None:
+            players = list( player_class(table=self.table, stake=args.stake, rounds_to_go=args.rounds)
+                            for player_class in player_classes for i in range(args.seats) )
+            crowd = TableSimulator(self.game, players)
+            for sim in crowd.simulators.values():
+                sim.streaming, sim.quantiles, sim.sink = args.stream, args.quantiles, self.sink
+            crowd.gather(workers=args.workers, seed=args.seed)
+            if self.sink is not None:
+                self.sink.close()
+            return
+
+        for player_class in player_classes:
+            _player = player_class(table=self.table, stake=args.stake, rounds_to_go=args.rounds)
+            if args.skip_ahead:
+                sim = SkipAheadSimulator(self.game, _player)
+                sim.streaming, sim.quantiles, sim.sink = args.stream, args.quantiles, self.sink
+                sim.gather(seed=args.seed)
+                continue
+            sim = Simulator(self.game, _player)
+            sim.streaming, sim.quantiles, sim.sink = args.stream, args.quantiles, self.sink
+            sim.cache = None if args.cache is None else ResultCache(args.cache)
+            if args.checkpoint is not None:
+                sim.checkpoint = "%s.%s" % (args.checkpoint, player_class.__name__)
+            if args.analytics:
+                sim.analytics = SessionAnalytics(sim.init_duration)
+            self.run(sim, args)
+
+        if self.sink is not None:
+            self.sink.close()
+        if self.game.profiler is not None:
+            self.game.profiler.report()
 
         # p57 = Passenger57(table=self.table, stake=100, rounds_to_go=100)
         # for i in range(95):
         #     self.game.cycle(p57)
 
+    def run(self, sim, args):
+        if args.precision is None:
+            sim.gather(workers=args.workers, seed=args.seed, resume=args.resume)
+        else:
+            sim.converge(precision=args.precision, max_samples=args.max_samples, max_seconds=args.max_seconds,
+                         workers=args.workers, seed=args.seed)
+
 if __name__ == '__main__':
-    RunGame()
+    # plugins register their strategies with the roulette module they import, not with this script's copy of it
+    import roulette
+    roulette.RunGame()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+__author__ = 'mattmckay'
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import threading
+import BaseHTTPServer
+import Queue
+import SocketServer
+
+from roulette import STRATEGIES, ResultCache, RunningStats, Table, WheelLayout, _gather_sessions
+
+
+class Job(object):
+    """
+    Job is one simulation request: SAMPLES sessions of a player at a table, from a master seed. Its statistics are
+    updated as the chunks of sessions finish, so they can be read while it runs.
+    """
+    def __init__(self, id, player, stake=100, limit=100, rounds=250, samples=50, seed=None, layout='american',
+                 parameters=None):
+        if player.lower() not in STRATEGIES:
+            raise ValueError("unknown strategy %s" % player)
+        self.id = id
+        self.player = player.lower()
+        self.stake = int(stake)
+        self.limit = int(limit)
+        self.rounds = int(rounds)
+        self.samples = int(samples)
+        self.seed = random.getrandbits(64) if seed is None else int(seed)
+        self.layout = layout
+        self.parameters = parameters or {}
+        self.status = 'queued'
+        self.error = None
+        self.maxima = RunningStats()
+        self.duration = RunningStats()
+        self.ruined = 0
+        self.changed = threading.Condition()
+
+    def seeds(self):
+        """
+        returns one RNG seed per session, the same ones Simulator.gather uses for the master seed
+        """
+        master = random.Random(self.seed)
+        return list( master.getrandbits(64) for i in range(self.samples) )
+
+    def update(self, status=None, results=(), error=None):
+        with self.changed:
+            for duration, maxima, stake in results:
+                self.duration.push(duration)
+                self.maxima.push(maxima)
+                self.ruined += stake == 0
+            if status is not None:
+                self.status = status
+            if error is not None:
+                self.error = error
+            self.changed.notify_all()
+
+    def finished(self):
+        return self.status in ('done', 'failed')
+
+    def summary(self):
+        with self.changed:
+            summary = {'id': self.id, 'status': self.status, 'player': self.player, 'stake': self.stake,
+                       'limit': self.limit, 'rounds': self.rounds, 'samples': self.samples, 'seed': self.seed,
+                       'completed': self.maxima.count}
+            if self.error is not None:
+                summary['error'] = self.error
+            if self.maxima.count:
+                summary['maxima'] = self.statistics(self.maxima)
+                summary['duration'] = self.statistics(self.duration)
+                summary['ruin_rate'] = float(self.ruined) / self.maxima.count
+            return summary
+
+    def statistics(self, stats):
+        return {'average': stats.mean, 'standard_deviation': stats.standard_deviation(), 'min': stats.min,
+                'max': stats.max}
+
+
+class SimulationService(object):
+    """
+    SimulationService queues Jobs and runs them one after another on a pool of WORKERS processes that stays up
+    between jobs, so each worker builds its Wheel for a layout once and reuses it. Jobs are split into chunks of
+    sessions and their statistics are updated after every chunk. Given a ResultCache, the sessions it already has
+    are served from it and only the rest are played. Jobs name their layout: a built-in one or one of LAYOUTS, a
+    dict of name : layout file path loaded when the service starts, never a path of their own.
+    """
+    def __init__(self, workers=1, cache=None, layouts=None):
+        self.workers = workers
+        self.cache = cache
+        self.layouts = dict( (name, WheelLayout.load(name)) for name in WheelLayout.builtin )
+        for name, path in (layouts or {}).items():
+            self.layouts[name] = WheelLayout.load(path)
+        self.pool = None if workers == 1 else multiprocessing.Pool(workers)
+        self.queue = Queue.Queue()
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, request):
+        """
+        queues a Job from the REQUEST dict and returns it
+        """
+        with self.lock:
+            id = str(next(self.ids))
+        job = Job(id, **request)
+        if job.layout not in self.layouts:
+            raise ValueError("unknown layout %s, choose from %s" % (job.layout, ", ".join(sorted(self.layouts))))
+        with self.lock:
+            self.jobs[id] = job
+        self.queue.put(job)
+        return job
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.update(status='running')
+            try:
+                for results in self.play(job):
+                    job.update(results=results)
+                job.update(status='done')
+            except Exception, e:
+                job.update(status='failed', error='%s: %s' % (e.__class__.__name__, e))
+
+    def play(self, job):
+        """
+        yields the (duration, maxima, final stake) of the job's sessions, a chunk at a time
+        """
+        seeds = job.seeds()
+        layout = self.layouts[job.layout]
+        if self.cache is None:
+            for results in self.play_seeds(job, layout, seeds):
+                yield results
+            return
+
+        # key the run by the player's own idea of its parameters, defaults included, as Simulator does
+        player_class = STRATEGIES[job.player]
+        parameters = player_class(table=Table(limit=job.limit), stake=job.stake, rounds_to_go=job.rounds,
+                                  **job.parameters).parameters()
+        key = self.cache.key(player_class, parameters, job.stake, job.limit, job.rounds, job.seed, layout)
+        cached = self.cache.get(key)[:len(seeds)]
+        yield cached
+        for results in self.play_seeds(job, layout, seeds[len(cached):]):
+            cached = cached + results
+            yield results
+        self.cache.put(key, cached)
+
+    def play_seeds(self, job, layout, seeds):
+        chunk = max(1, min(1000, len(seeds) // (self.workers * 4)))
+        jobs = ( (STRATEGIES[job.player], job.parameters, job.limit, job.stake, job.rounds, None, layout,
+                  seeds[i:i + chunk]) for i in range(0, len(seeds), chunk) )
+        if self.pool is None:
+            return itertools.imap(_gather_sessions, jobs)
+        return self.pool.imap(_gather_sessions, jobs)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.pool is not None:
+            self.pool.terminate()
+
+
+class ServiceHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    POST /jobs queues a job from a JSON body. GET /jobs lists the jobs, GET /jobs/<id> returns one with its
+    statistics so far and GET /jobs/<id>/stream sends them again, one JSON line, each time they change until the
+    job has finished.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self.send_json(404, {'error': 'not found'})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+            job = self.server.service.submit(dict( (str(k), v) for k, v in request.items() ))
+        except (ValueError, TypeError), e:
+            return self.send_json(400, {'error': str(e)})
+        self.send_json(202, job.summary())
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['jobs']:
+            jobs = self.server.service.jobs.values()
+            return self.send_json(200, sorted( (job.summary() for job in jobs), key=lambda job: int(job['id']) ))
+        job = self.server.service.jobs.get(parts[1]) if len(parts) > 1 and parts[0] == 'jobs' else None
+        if job is None or len(parts) > 3 or (len(parts) == 3 and parts[2] != 'stream'):
+            return self.send_json(404, {'error': 'not found'})
+        if len(parts) == 2:
+            return self.send_json(200, job.summary())
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        seen = None
+        while True:
+            # wait for a change under the condition, but write with it released so a slow client can't hold up
+            # the dispatcher's Job.update
+            with job.changed:
+                while job.summary() == seen:
+                    job.changed.wait()
+                seen = job.summary()
+            self.write_chunk(json.dumps(seen) + '\n')
+            if seen['status'] in ('done', 'failed'):
+                break
+        self.write_chunk('')
+
+    def write_chunk(self, data):
+        self.wfile.write('%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def send_json(self, code, body):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServiceServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(self, address, ServiceHandler)
+        self.service = service
+
+
+class RunService(object):
+    def __init__(self):
+        parser = argparse.ArgumentParser(description='This program serves Roulette simulations over HTTP')
+        parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+        parser.add_argument('--port', help='Port to listen on', default=8357, type=int)
+        parser.add_argument('-w', '--workers', help='Worker processes', default=1, type=int)
+        parser.add_argument('--cache', help='Directory finished jobs are cached in', default=None)
+        parser.add_argument('--cache-size', help='Runs kept in memory', default=128, type=int)
+        parser.add_argument('--layout', help='Serve a custom layout file under a name jobs can ask for, as '
+                            'name=path', action='append', default=[])
+        args = parser.parse_args()
+        layouts = dict( layout.split('=', 1) for layout in args.layout if '=' in layout )
+        if len(layouts) != len(args.layout):
+            parser.error("--layout takes name=path")
+
+        cache = None if args.cache is None else ResultCache(args.cache, args.cache_size)
+        service = SimulationService(workers=args.workers, cache=cache, layouts=layouts)
+        server = ServiceServer((args.host, args.port), service)
+        print 'Serving on http://%s:%d/jobs' % server.server_address
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            service.close()
+
+if __name__ == '__main__':
+    RunService()
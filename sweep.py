@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+__author__ = 'mattmckay'
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+
+from roulette import STRATEGIES, Martingale, RunningStats, WheelLayout, _gather_sessions
+
+
+COLUMNS = ('player', 'stake', 'limit', 'rounds', 'base_wager', 'samples', 'maxima_average',
+           'maxima_standard_deviation', 'duration_average', 'duration_standard_deviation', 'ruin_rate')
+
+
+def parse_range(text):
+    """
+    parses "start:stop:step" (stop included) or a comma separated list of ints
+    """
+    if ':' in text:
+        parts = list( int(p) for p in text.split(':') )
+        start, stop, step = parts[0], parts[1], parts[2] if len(parts) > 2 else 1
+        return range(start, stop + 1, step)
+    return list( int(p) for p in text.split(',') )
+
+
+class Sweep(object):
+    """
+    Sweep runs the Simulator sessions of one player class for every cell of a grid of stake, table limit, rounds and
+    base wager. The cells are scheduled over a pool of worker processes which all share the one compiled wheel
+    layout. Each finished cell is appended to a CHECKPOINT file, so an interrupted sweep picks up where it stopped.
+    The checkpoint starts with the sweep's player, samples, seed and layout, and isn't resumed by another sweep.
+    """
+    def __init__(self, player_class, stakes, limits, rounds, base_wagers, samples=50, seed=0, layout='american',
+                 checkpoint=None):
+        self.player_class = player_class
+        self.stakes = stakes
+        self.limits = limits
+        self.rounds = rounds
+        # base wager is a Martingale parameter, other players have a single None column
+        self.base_wagers = base_wagers if issubclass(player_class, Martingale) else [None]
+        self.samples = samples
+        self.seed = seed
+        self.layout = WheelLayout.load(layout)
+        self.checkpoint = checkpoint
+
+    def cells(self):
+        """
+        returns every (stake, limit, rounds, base_wager) of the grid
+        """
+        return list(itertools.product(self.stakes, self.limits, self.rounds, self.base_wagers))
+
+    def config(self):
+        """
+        returns what decides the results of a cell besides the cell itself
+        """
+        return {'player': self.player_class.__name__, 'samples': self.samples, 'seed': self.seed,
+                'layout': hashlib.sha1(self.layout.dumps()).hexdigest()}
+
+    def completed(self):
+        """
+        returns the rows of the checkpoint, by cell. Raises ValueError if the checkpoint is another sweep's. A last line
+        left unfinished by a crash is ignored, and its cell is played again
+        """
+        rows = {}
+        if self.checkpoint is not None and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as f:
+                text = f.read()
+            lines = list( json.loads(line) for line in text[:text.rfind('\n') + 1].splitlines() if line.strip() )
+            if lines and lines[0].get('config') != self.config():
+                raise ValueError("%s is the checkpoint of another sweep: %s" %
+                                 (self.checkpoint, lines[0].get('config')))
+            for row in lines[1:]:
+                rows[(row['stake'], row['limit'], row['rounds'], row['base_wager'])] = row
+        return rows
+
+    def run(self, workers=1):
+        """
+        plays every cell not already in the checkpoint and returns all the rows, in grid order
+        """
+        rows = self.completed()
+        jobs = list( (self.player_class, cell, self.samples, self.seed, self.layout)
+                     for cell in self.cells() if cell not in rows )
+
+        checkpoint = None if self.checkpoint is None else open(self.checkpoint, 'a+')
+        if checkpoint is not None:
+            # rows are appended after the last whole line, over one a crash left unfinished
+            checkpoint.seek(0)
+            size = checkpoint.read().rfind('\n') + 1
+            checkpoint.truncate(size)
+            if size == 0:
+                checkpoint.write(json.dumps({'config': self.config()}, sort_keys=True) + '\n')
+        pool = None if workers == 1 else multiprocessing.Pool(workers)
+        try:
+            results = itertools.imap(_run_cell, jobs) if pool is None else pool.imap_unordered(_run_cell, jobs)
+            for row in results:
+                rows[(row['stake'], row['limit'], row['rounds'], row['base_wager'])] = row
+                if checkpoint is not None:
+                    checkpoint.write(json.dumps(row, sort_keys=True) + '\n')
+                    checkpoint.flush()
+        finally:
+            if pool is not None:
+                pool.terminate()
+            if checkpoint is not None:
+                checkpoint.close()
+        return list( rows[cell] for cell in self.cells() )
+
+    def write(self, path, rows):
+        """
+        writes the rows to PATH as CSV, one line per cell
+        """
+        with open(path, 'wb') as f:
+            writer = csv.DictWriter(f, COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def _run_cell(job):
+    """
+    plays the sessions of one grid cell. Runs in the Sweep worker processes.
+    """
+    player_class, cell, samples, seed, layout = job
+    stake, limit, rounds, base_wager = cell
+    parameters = {} if base_wager is None else {'base_wager': base_wager}
+
+    # each cell has its own RNG streams, whatever the grid and the order the cells run in
+    master = random.Random(int(hashlib.sha1(json.dumps([seed, cell])).hexdigest(), 16))
+    seeds = list( master.getrandbits(64) for i in range(samples) )
+
+    maxima, duration = RunningStats(), RunningStats()
+    ruined = 0
+    for d, m, s in _gather_sessions((player_class, parameters, limit, stake, rounds, None, layout, seeds)):
+        duration.push(d)
+        maxima.push(m)
+        ruined += s == 0
+    return {'player': player_class.__name__, 'stake': stake, 'limit': limit, 'rounds': rounds,
+            'base_wager': base_wager, 'samples': samples,
+            'maxima_average': maxima.mean, 'maxima_standard_deviation': maxima.standard_deviation(),
+            'duration_average': duration.mean, 'duration_standard_deviation': duration.standard_deviation(),
+            'ruin_rate': float(ruined) / samples}
+
+
+class RunSweep(object):
+    def __init__(self):
+        parser = argparse.ArgumentParser(description='This program sweeps Roulette simulations over a grid')
+        parser.add_argument('-p', '--player', help='Player class', default='martingale', choices=sorted(STRATEGIES))
+        parser.add_argument('-s', '--stake', help='Initial stakes, start:stop:step or a,b,c', default='100',
+                            type=parse_range)
+        parser.add_argument('-l', '--limit', help='Table bet limits, start:stop:step or a,b,c', default='100',
+                            type=parse_range)
+        parser.add_argument('-r', '--rounds', help='Rounds per session, start:stop:step or a,b,c', default='250',
+                            type=parse_range)
+        parser.add_argument('-b', '--base-wager', help='Martingale base wagers, start:stop:step or a,b,c',
+                            default='1', type=parse_range)
+        parser.add_argument('-n', '--samples', help='Sessions per cell', default=50, type=int)
+        parser.add_argument('-w', '--workers', help='Worker processes', default=1, type=int)
+        parser.add_argument('--seed', help='Master seed', default=0, type=int)
+        parser.add_argument('--layout', help='Wheel layout: american, european or a layout file', default='american')
+        parser.add_argument('-c', '--checkpoint', help='File finished cells are appended to, and resumed from',
+                            default=None)
+        parser.add_argument('-o', '--output', help='CSV results table', default='sweep.csv')
+        args = parser.parse_args()
+
+        sweep = Sweep(STRATEGIES[args.player], args.stake, args.limit, args.rounds, args.base_wager,
+                      samples=args.samples, seed=args.seed, layout=args.layout, checkpoint=args.checkpoint)
+        rows = sweep.run(workers=args.workers)
+        sweep.write(args.output, rows)
+        print 'Swept %d cells into %s' % (len(rows), args.output)
+
+if __name__ == '__main__':
+    RunSweep()
@@ -2,13 +2,23 @@
 __author__ = 'mattmckay'
 
 import collections
+import json
 import logging
+import math
+import os
+import random
+import shutil
 import sys
+import tempfile
 import unittest
 
+import roulette
 from roulette import (
-    Bet, Bin, BinBuilder, InvalidBet, Martingale, NonRandom, Outcome, Passenger57, RouletteGame,
-    SevenReds, Simulator, Table, Wheel,
+    BatchSimulator, Bet, Bin, BinBuilder, CounterBackend, Histogram, ImportanceSimulator, InvalidBet,
+    MarkovEvaluator, Martingale, NonRandom, NumpyBackend, Outcome, P2Quantile, PairedSimulator, Passenger57,
+    PayoutMatrix, Profiler, RandomBackend, ResultCache, ResultSink, RouletteGame, RunningStats, SessionAnalytics,
+    SevenReds, Simulator, SkipAheadSimulator, StrategyMachine, Table, TableSimulator, TiltedRandom, Wheel,
+    WheelLayout,
 )
 
 
@@ -32,9 +42,23 @@ class OutcomeTestCase(unittest.TestCase):
         # tests hash equality
         self.assertTrue(outcome_one == outcome_two)
         self.assertTrue(outcome_one != outcome_three)
+        self.assertEqual(hash(outcome_one), hash(outcome_two))
+        self.assertEqual(len(set([outcome_one, outcome_two, outcome_three])), 2)
         self.assertEqual(outcome_one.win_amount(1), 1 )
         self.assertEqual(outcome_three.win_amount(1), 2)
 
+        # Outcomes are immutable
+        self.assertRaises(AttributeError, lambda: setattr(outcome_one, "odds", 2))
+
+    def test_intern(self):
+        black = Outcome.intern("Black", 1)
+        self.assertTrue(black is Outcome.intern("Black", 1))
+        self.assertRaises(ValueError, lambda: Outcome.intern("Black", 2))
+
+        wheel = Wheel(NonRandom())
+        BinBuilder().build_bins(wheel)
+        self.assertTrue(wheel.get_outcome("Black") is black)
+
     def tearDown(self):
         pass
 
@@ -61,6 +85,13 @@ class BinTestCase(unittest.TestCase):
         bin_two = Bin(outcome_five, outcome_six)
         print 'what is bin two?: ', bin_two
 
+        self.assertEqual(bin_one.outcomes, set([outcome_three, outcome_four]))
+        self.assertTrue(Outcome("D", 2) in bin_one.outcomes)
+        bin_one.add(outcome_five)
+        bin_one.freeze()
+        self.assertEqual(bin_one.outcomes, frozenset([outcome_three, outcome_four, outcome_five]))
+        self.assertRaises(TypeError, lambda: bin_one.add(outcome_six))
+
     def tearDown(self):
         pass
 
@@ -102,6 +133,70 @@ class WheelTestCase(unittest.TestCase):
         BB = BinBuilder()
         BB.build_bins(self.wheel_two)
 
+        black = self.wheel_two.get_outcome("black")
+        self.assertEqual(black.name, "Black")
+        self.assertTrue(black is self.wheel_two.get_outcome("Black"))
+        self.assertEqual(len(self.wheel_two.get_bins("Black")), 18)
+        self.assertTrue(self.wheel_two.is_winner("Black", self.wheel_two.get(2)))
+        self.assertFalse(self.wheel_two.is_winner("Black", self.wheel_two.get(1)))
+        self.assertRaises(KeyError, lambda: self.wheel_two.get_outcome("Purple"))
+
+
+class WheelBackendTestCase(unittest.TestCase):
+
+    def spin_numbers(self, wheel, n):
+        return list( wheel.bin_index[wheel.next()] for i in range(n) )
+
+    def test_RandomBackend(self):
+        # block spins follow the same stream as random.Random.choice
+        plain = Wheel(random.Random(11))
+        blocked = Wheel(backend=RandomBackend(11), block_size=16)
+        self.assertEqual(self.spin_numbers(plain, 100), self.spin_numbers(blocked, 100))
+
+    def test_CounterBackend(self):
+        wheel = Wheel(backend=CounterBackend(3), block_size=7)
+        spins = self.spin_numbers(wheel, 50)
+        self.assertTrue(all( 0 <= n < 38 for n in spins ))
+        wheel.seed(3)
+        self.assertEqual(self.spin_numbers(wheel, 50), spins)
+
+        skipped = CounterBackend(3)
+        skipped.skip(20)
+        self.assertEqual(skipped.spins(30, 38), spins[20:])
+
+        # unseeded backends don't all spin the same
+        self.assertNotEqual(CounterBackend().spins(50, 38), CounterBackend().spins(50, 38))
+
+    @unittest.skipIf(roulette.numpy is None, "numpy is not installed")
+    def test_CounterBackend_numpy(self):
+        # the arrays hash to the same spins as the pure Python loop, past the wrap of the 64 bit key
+        for key in (3, (1 << 64) - 5):
+            backend, plain = CounterBackend(key), CounterBackend(key)
+            backend.skip(1000)
+            plain.skip(1000)
+            self.assertEqual(backend.numpy_spins(5000, 37), plain.python_spins(5000, 37))
+            self.assertEqual(backend.counter, plain.counter)
+
+    @unittest.skipIf(roulette.numpy is None, "numpy is not installed")
+    def test_NumpyBackend(self):
+        wheel = Wheel(backend=NumpyBackend(5))
+        spins = self.spin_numbers(wheel, 5000)
+        self.assertEqual(set(spins), set(range(38)))
+        wheel.seed(5)
+        self.assertEqual(self.spin_numbers(wheel, 5000), spins)
+
+    def test_seeded_gather(self):
+        results = []
+        for backend in (None, CounterBackend()):
+            wheel = Wheel(backend=backend)
+            BinBuilder().build_bins(wheel)
+            table = Table(limit=100)
+            sim = Simulator(RouletteGame(wheel, table), Martingale(table=table, stake=100, rounds_to_go=250))
+            sim.samples = 10
+            sim.gather(workers=2, seed=1)
+            results.append(sim.maxima)
+        self.assertNotEqual(results[0], results[1])
+
 
 class BinBuilderTestCase(unittest.TestCase):
     def setUp(self):
@@ -132,6 +227,138 @@ class BinBuilderTestCase(unittest.TestCase):
         len_all_outcomes = sum(list(len(i) for i in all_bin_methods_results))
 
 
+class PayoutMatrixTestCase(unittest.TestCase):
+
+    def test_PayoutMatrix(self):
+        wheel = Wheel(NonRandom())
+        BB = BinBuilder()
+        BB.build_bins(wheel)
+        payouts = BB.build_payouts(wheel)
+
+        self.assertTrue(isinstance(payouts, PayoutMatrix))
+        self.assertEqual(len(payouts.rows), 38)
+        self.assertEqual(len(payouts.rows[0]), len(wheel.outcome_index))
+
+        black, red = wheel.get_outcome("Black"), wheel.get_outcome("Red")
+        row = payouts.row(wheel.get(2)) # 2 is black
+        self.assertEqual(payouts.payout(row, Bet(10, black)), 20)
+        self.assertEqual(payouts.payout(row, Bet(10, red)), 0)
+        self.assertEqual(payouts.settle(wheel.get(2), [Bet(10, black), Bet(5, red), Bet(1, wheel.get_outcome("2"))]), 56)
+        self.assertEqual(payouts.returns(wheel.get(2), [Bet(10, black), Bet(5, red)]), [20, 0])
+
+        # the game pays what the matrix returns
+        column = payouts.columns["Black"]
+        payouts.rows = tuple( tuple(3 if m and col == column else m for col, m in enumerate(r)) for r in payouts.rows )
+        table = Table(limit=100)
+        game = RouletteGame(wheel, table, payouts)
+        wheel.rng.set_seed(2)
+        _p57 = Passenger57(table=table, stake=100, rounds_to_go=10)
+        game.cycle(_p57)
+        self.assertEqual(_p57.stake, 102)
+        game.profiler = Profiler()
+        game.cycle(_p57)
+        game.cycle_all([_p57])
+        self.assertEqual(_p57.stake, 106)
+
+    def test_cycle(self):
+        # the same sessions with and without the matrix, one player at a time or a table of them
+        stakes = []
+        for payouts in (None, True):
+            wheel = Wheel()
+            BinBuilder().build_bins(wheel)
+            wheel.seed(11)
+            table = Table(limit=100)
+            game = RouletteGame(wheel, table, payouts and BinBuilder().build_payouts(wheel))
+            players = list( cls(table=table, stake=100, rounds_to_go=50) for cls in (Martingale, SevenReds) )
+            for i in range(50):
+                game.cycle(players[0])
+                game.cycle_all(players)
+            stakes.append(list( p.stake for p in players ))
+        self.assertEqual(stakes[0], stakes[1])
+
+
+class WheelLayoutTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = WheelLayout.cache_dir
+        WheelLayout.cache_dir = tempfile.mkdtemp()
+        WheelLayout._loaded.clear()
+
+    def tearDown(self):
+        shutil.rmtree(WheelLayout.cache_dir)
+        WheelLayout.cache_dir = self.cache_dir
+        WheelLayout._loaded.clear()
+
+    def test_american(self):
+        layout = WheelLayout.load("american")
+        self.assertTrue(WheelLayout.load("american") is layout)
+        self.assertEqual(os.listdir(WheelLayout.cache_dir), ["american-v%d.layout" % WheelLayout.version])
+
+        # a fresh process would read the compiled layout back from the cache
+        WheelLayout._loaded.clear()
+        cached = WheelLayout.load("american")
+        self.assertEqual((cached.outcomes, cached.bins), (layout.outcomes, layout.bins))
+
+        # the compiled wheel matches the one built from the BinBuilder methods
+        wheel, expected = Wheel(), Wheel()
+        BinBuilder().build_bins(wheel)
+        for number, outcome in BinBuilder().american_outcomes():
+            expected.add_outcome(number, outcome)
+        self.assertEqual(list( b.outcomes for b in wheel.bins ), list( b.outcomes for b in expected.bins ))
+        self.assertTrue(wheel.layout is cached)
+
+        # without a cache directory nothing is written
+        cache_dir, WheelLayout.cache_dir = WheelLayout.cache_dir, None
+        WheelLayout._loaded.clear()
+        self.assertEqual(WheelLayout.load("european").name, "european")
+        WheelLayout.cache_dir = cache_dir
+        self.assertEqual(os.listdir(WheelLayout.cache_dir), ["american-v%d.layout" % WheelLayout.version])
+
+    def test_european(self):
+        wheel = Wheel()
+        BinBuilder(layout="european").build_bins(wheel)
+        self.assertEqual(len(wheel.bins), 37)
+        self.assertEqual(len(wheel.get_bins("Black")), 18)
+        self.assertRaises(KeyError, lambda: wheel.get_outcome("Five Bet"))
+
+    def test_custom(self):
+        path = os.path.join(WheelLayout.cache_dir, "coin.json")
+        with open(path, "w") as f:
+            json.dump({"name": "coin", "size": 2, "outcomes": [["Black", 1, [0]], ["Red", 1, [1]]]}, f)
+        wheel = Wheel(NonRandom())
+        BinBuilder(layout=path).build_bins(wheel)
+        self.assertEqual(wheel.layout.name, "coin")
+        self.assertEqual(wheel.get_bins("Red"), set([1]))
+
+        table = Table(limit=100)
+        game = RouletteGame(wheel, table)
+        wheel.rng.set_seed(0)
+        _p57 = Passenger57(table=table, stake=100, rounds_to_go=10)
+        game.cycle(_p57)
+        self.assertEqual(_p57.stake, 101)
+
+        # a variant paying other odds on an existing name doesn't clash with the canonical OUTCOMEs
+        path = os.path.join(WheelLayout.cache_dir, "black.json")
+        with open(path, "w") as f:
+            json.dump({"name": "black", "size": 2, "outcomes": [["Black", 2, [0]], ["Red", 1, [1]]]}, f)
+        BinBuilder(layout=path).build_bins(wheel)
+        self.assertEqual(wheel.get_outcome("Black").odds, 2)
+        self.assertTrue(wheel.get_outcome("Red") is Outcome.intern("Red", 1))
+        self.assertEqual(Outcome.intern("Black", 1).odds, 1)
+
+        # and the game pays the wheel's odds, with or without the payout matrix, as the exact evaluator does
+        for payouts in (None, BinBuilder(layout=path).build_payouts(wheel)):
+            game = RouletteGame(wheel, table, payouts)
+            wheel.rng.set_seed(0)
+            _p57 = Passenger57(table=table, stake=100, rounds_to_go=10)
+            game.cycle(_p57)
+            self.assertEqual(_p57.stake, 102)
+        _p57 = Passenger57(table=table, stake=100, rounds_to_go=1)
+        evaluator = MarkovEvaluator(RouletteGame(wheel, table), _p57)
+        evaluator.init_stake, evaluator.init_duration = 100, 1
+        self.assertEqual(sorted(evaluator.evaluate().maxima), [99, 102])
+
+
 class BetTestCase(unittest.TestCase):
 
     def test_Bin(self):
@@ -151,6 +378,10 @@ class BetTestCase(unittest.TestCase):
 
         self.assertEqual(str(bet1), "amount on Red (1:1)")
 
+        self.assertEqual(bet1, Bet(10, Outcome("Red", 1)))
+        self.assertEqual(hash(bet1), hash(Bet(10, Outcome("Red", 1))))
+        self.assertRaises(AttributeError, lambda: setattr(bet1, "amount", 20))
+
 
 class TableTestCase(unittest.TestCase):
 
@@ -179,11 +410,45 @@ class TableTestCase(unittest.TestCase):
         # test that Table object is iterable
         self.assertTrue(isinstance(tbl, collections.Iterable))
 
+    def test_TableSettle(self):
+        tbl = Table(limit=30)
+        tbl.place_bet(Bet(10, Outcome("Red", 1)))
+        tbl.place_bet(Bet(20, Outcome("Black", 1)))
+        self.assertEqual(tbl.total, 30)
+        self.assertEqual(len(tbl), 2)
+
+        tbl.remove_bet()
+        self.assertEqual(tbl.total, 20)
+        self.assertTrue(tbl.is_valid(Bet(10, Outcome("Red", 1))))
+
+        bets = tbl.settle()
+        self.assertEqual(list(b.amount for b in bets), [20])
+        self.assertEqual((tbl.total, len(tbl)), (0, 0))
+        tbl.remove_bet() # nothing left to remove
+        self.assertEqual(tbl.total, 0)
+
     def test_TableStr(self):
         tbl = Table(limit=30)
         tbl.place_bet(Bet(10, Outcome("Red", 1)))
         self.assertEquals(str(tbl), "['amount on Red (1:1)']")
 
+class StrategyRegistryTestCase(unittest.TestCase):
+
+    def tearDown(self):
+        roulette.STRATEGIES.pop("flat", None)
+
+    def test_register(self):
+        self.assertTrue(roulette.STRATEGIES["sevenreds"] is SevenReds)
+
+        class Flat(Passenger57):
+            pass
+        roulette.register_strategy("Flat", Flat)
+        self.assertTrue(roulette.STRATEGIES["flat"] is Flat)
+        roulette.register_strategy("flat", Flat) # registering again is harmless
+        self.assertRaises(ValueError, roulette.register_strategy, "flat", Passenger57)
+        self.assertRaises(TypeError, roulette.register_strategy, "table", Table)
+
+
 class GameTestCase(unittest.TestCase):
     """
     This runs the game a few times for testing
@@ -212,6 +477,68 @@ class GameTestCase(unittest.TestCase):
         for i in range(4):
             self.game.cycle(_p57)
 
+class SimulatorTestCase(unittest.TestCase):
+    """
+    make_simulator() builds a fresh Simulator for each run: a player with a stake of 100 playing ROUNDS at a table
+    of LIMIT, on an American wheel seeded with SEED. The Simulator attributes in SIMULATOR are set on every one, and
+    DIRECTORY is a scratch directory for the test
+    """
+    seed = None
+    limit = 100
+    rounds = 250
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.simulator = {}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_simulator(self, player_class=Martingale, **attributes):
+        wheel = Wheel(random.Random(self.seed))
+        BinBuilder().build_bins(wheel)
+        table = Table(limit=self.limit)
+        sim = Simulator(RouletteGame(wheel, table), player_class(table=table, stake=100, rounds_to_go=self.rounds))
+        for name, value in dict(self.simulator, **attributes).items():
+            setattr(sim, name, value)
+        return sim
+
+class ProfilerTestCase(SimulatorTestCase):
+    seed, limit = 8, 10
+
+    def test_profile(self):
+        profiler = Profiler()
+        sim = self.make_simulator()
+        sim.game.profiler = profiler
+        stakes = sim.session()
+
+        # profiling doesn't change the game
+        self.assertEqual(stakes, self.make_simulator().session())
+        self.assertEqual(profiler.spins, len(stakes))
+        self.assertEqual(profiler.wins + profiler.losses, profiler.bets)
+        self.assertTrue(profiler.rejected > 0) # bets of 16 and more are over the limit
+        self.assertEqual(profiler.bets + profiler.rejected, profiler.spins)
+        self.assertTrue(all( profiler.seconds[phase] >= 0 for phase in Profiler.phases ))
+
+class GameWatchesTestCase(SimulatorTestCase):
+    seed, rounds = 11, 500
+
+    def test_seven_reds(self):
+        class EverySpin(SevenReds):
+            watches = None
+
+        # SevenReds is told only about reds and the spin that ends a streak of them, and plays the same
+        self.assertEqual(self.make_simulator(SevenReds).session(), self.make_simulator(EverySpin).session())
+
+    def test_martingale(self):
+        notified = []
+        class Counting(Martingale):
+            def winners(self, wheel_obj, winning_bin):
+                notified.append(winning_bin)
+
+        self.make_simulator(Counting).session()
+        self.assertEqual(notified, [])
+
 class GameRed(unittest.TestCase):
     """
     Tests that
@@ -253,6 +580,18 @@ class MartingaleTestBlack(GameBlack):
         _martin.set_rounds(20)
         self.assertEqual(_martin.rounds_to_go, 20)
 
+class MartingalePayoutsTestBlack(GameBlack):
+    """
+    Black wins every time, bets settled through the PayoutMatrix
+    """
+    def test_black(self):
+        self.game.payouts = BinBuilder().build_payouts(self.game.wheel)
+        _martin = Martingale(table=self.table, stake=100, rounds_to_go=10)
+        for i in range(4):
+            self.game.cycle(_martin)
+
+        self.assertEqual(_martin.stake, 104)
+
 class MartingaleTestRed(GameRed):
     """
     Red loses every time
@@ -288,6 +627,467 @@ class SimulatorMartingaleRed(GameRed):
         sim = Simulator(self.game, _martin)
         self.assertEqual(sim.standard_deviation([2,4,4,4,5,5,7,9]), 2)
 
+class SimulatorStreamingRed(GameRed):
+    """
+    Martingale loses every round, statistics kept in streaming mode
+    """
+    def test_streaming_gather(self):
+        _martin = Martingale(table=self.table, stake=100, rounds_to_go=50)
+        sim = Simulator(self.game, _martin)
+        sim.streaming = True
+        sim.quantiles = (0.5,)
+        sim.gather()
+        self.assertEqual(sim.duration, [])
+        self.assertEqual(sim.duration_stats.count, 50)
+        self.assertEqual(sim.duration_stats.mean, 7)
+        self.assertEqual(sim.duration_stats.variance(), 0)
+        self.assertEqual(sim.maxima_stats.max, 99)
+        self.assertEqual(sim.maxima_stats.quantiles[0].value(), 99)
+
+    def test_session_summary(self):
+        _martin = Martingale(table=self.table, stake=100, rounds_to_go=100)
+        sim = Simulator(self.game, _martin)
+        self.assertEqual(sim.session_summary(), (7, 99))
+
+class RunningStatsTestCase(unittest.TestCase):
+
+    def test_RunningStats(self):
+        stats = RunningStats()
+        for x in [2,4,4,4,5,5,7,9]:
+            stats.push(x)
+        self.assertEqual(stats.count, 8)
+        self.assertAlmostEqual(stats.mean, 5)
+        self.assertAlmostEqual(stats.standard_deviation(), 2)
+        self.assertEqual((stats.min, stats.max), (2, 9))
+
+    def test_P2Quantile(self):
+        values = list(range(1, 10001))
+        random.Random(7).shuffle(values)
+        median, tail = P2Quantile(0.5), P2Quantile(0.95)
+        for x in values:
+            median.push(x)
+            tail.push(x)
+        self.assertTrue(abs(median.value() - 5000) < 200)
+        self.assertTrue(abs(tail.value() - 9500) < 200)
+
+    def test_merge(self):
+        values = [2,4,4,4,5,5,7,9,11,0]
+        whole, first, second = RunningStats(), RunningStats(), RunningStats()
+        for x in values:
+            whole.push(x)
+        for x in values[:3]:
+            first.push(x)
+        for x in values[3:]:
+            second.push(x)
+        first.merge(second).merge(RunningStats())
+        self.assertEqual(first.count, whole.count)
+        self.assertAlmostEqual(first.mean, whole.mean)
+        self.assertAlmostEqual(first.variance(), whole.variance())
+        self.assertEqual((first.min, first.max), (0, 11))
+        self.assertRaises(ValueError, first.merge, RunningStats([0.5]))
+
+    def test_Histogram(self):
+        values = list(range(1, 101))
+        random.Random(7).shuffle(values)
+        first, second = Histogram(), Histogram()
+        for x in values[:30]:
+            first.push(x)
+        for x in values[30:]:
+            second.push(x)
+        histogram = first.merge(second)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(list( histogram.quantile(p) for p in (0.05, 0.5, 0.95, 1) ), [5, 50, 95, 100])
+        self.assertEqual(histogram.at_most(10), 10)
+        self.assertAlmostEqual(histogram.mean(), 50.5)
+
+        wide = Histogram(10)
+        for x in values:
+            wide.push(x)
+        self.assertEqual(wide.quantile(0.5), 50) # 50 is alone in the bin [50, 60)
+        self.assertEqual(wide.at_most(15), 19)
+        self.assertRaises(ValueError, histogram.merge, wide)
+
+class SimulatorSeededTestCase(SimulatorTestCase):
+    """
+    Seeded gathers are reproducible and don't depend on the number of workers
+    """
+    def setUp(self):
+        SimulatorTestCase.setUp(self)
+        self.simulator["samples"] = 20
+
+    def test_workers(self):
+        one = self.make_simulator()
+        one.gather(seed=42)
+        three = self.make_simulator()
+        three.gather(workers=3, seed=42)
+        self.assertEqual(one.duration, three.duration)
+        self.assertEqual(one.maxima, three.maxima)
+
+        other = self.make_simulator()
+        other.gather(seed=43)
+        self.assertNotEqual(one.maxima, other.maxima)
+
+        streaming = self.make_simulator()
+        streaming.streaming = True
+        streaming.gather(workers=2, seed=42)
+        self.assertAlmostEqual(streaming.maxima_stats.mean, one.get_average(one.maxima))
+        self.assertAlmostEqual(streaming.duration_stats.standard_deviation(), one.standard_deviation(one.duration))
+
+class SessionAnalyticsTestCase(SimulatorTestCase):
+
+    def setUp(self):
+        SimulatorTestCase.setUp(self)
+        self.simulator["samples"] = 40
+
+    def test_gather(self):
+        sim = self.make_simulator(analytics=SessionAnalytics(250))
+        sim.gather()
+        analytics = sim.analytics
+        self.assertEqual(analytics.maxima.counts, collections.Counter(sim.maxima))
+        self.assertEqual(analytics.duration.counts, collections.Counter(sim.duration))
+        self.assertEqual(sum( stakes.count for stakes in analytics.stakes ), 40 * 250)
+        ruined = analytics.final_stake.counts.get(0, 0)
+        self.assertAlmostEqual(analytics.ruin_by_round()[-1], ruined / 40.0)
+        self.assertEqual(analytics.stakes[-1].counts, analytics.final_stake.counts)
+        ruin = analytics.ruin_by_round()
+        self.assertEqual(ruin, sorted(ruin))
+        # a ruined session fell from its peak all the way to 0
+        self.assertTrue(analytics.drawdown.quantile(1) >= 100)
+
+        # the same stakes as keeping them
+        sim.reset_player()
+        sim.game.wheel.seed(3)
+        stakes = sim.session()
+        sim.reset_player()
+        sim.game.wheel.seed(3)
+        analytics = sim.analytics = SessionAnalytics(250)
+        sim.analysed_session()
+        self.assertEqual(list( analytics.stakes[t].quantile(0.5) for t in range(len(stakes)) ), stakes)
+
+    def test_workers(self):
+        one = self.make_simulator(analytics=SessionAnalytics(250))
+        one.gather(seed=42)
+        plain = self.make_simulator()
+        plain.gather(seed=42)
+        two = self.make_simulator(analytics=SessionAnalytics(250))
+        two.gather(workers=2, seed=42)
+        self.assertEqual(one.maxima, plain.maxima)
+        self.assertEqual(one.analytics.ruin_by_round(), two.analytics.ruin_by_round())
+        self.assertEqual(list( one.analytics.stake_band(t) for t in (1, 100, 250) ),
+                         list( two.analytics.stake_band(t) for t in (1, 100, 250) ))
+        self.assertEqual(one.analytics.drawdown.counts, two.analytics.drawdown.counts)
+
+    def test_against_evaluator(self):
+        wheel = Wheel()
+        BinBuilder().build_bins(wheel)
+        table = Table(limit=100)
+        player = Martingale(table=table, stake=20, rounds_to_go=40)
+        evaluator = MarkovEvaluator(RouletteGame(wheel, table), player)
+        evaluator.init_stake, evaluator.init_duration = 20, 40
+        exact = evaluator.evaluate().ruin_by_round()
+
+        sim = Simulator(evaluator.game, player)
+        sim.init_stake, sim.init_duration, sim.samples = 20, 40, 2000
+        sim.analytics = SessionAnalytics(40)
+        sim.gather(seed=5)
+        ruin = sim.analytics.ruin_by_round()
+        self.assertEqual(len(ruin), len(exact))
+        for t in (10, 20, 40):
+            self.assertTrue(abs(ruin[t - 1] - exact[t - 1]) < 0.05)
+
+class PairedSimulatorTestCase(unittest.TestCase):
+
+    def make_game(self):
+        wheel = Wheel()
+        BinBuilder().build_bins(wheel)
+        return RouletteGame(wheel, Table(limit=100))
+
+    def test_replay(self):
+        wheel = self.make_game().wheel
+        wheel.seed(3)
+        spins = wheel.draw(5)
+        wheel.replay(spins)
+        self.assertEqual(list( wheel.bin_index[wheel.next()] for i in range(5) ), spins)
+
+    def test_gather(self):
+        game = self.make_game()
+        paired = PairedSimulator(game, [Martingale(table=game.table, stake=100, rounds_to_go=250),
+                                        Passenger57(table=game.table, stake=100, rounds_to_go=250)])
+        paired.samples = 40
+        paired.gather(seed=42)
+
+        # the first player sees the same spins as in a plain seeded gather
+        sim = Simulator(game, Martingale(table=game.table, stake=100, rounds_to_go=250))
+        sim.samples = 40
+        sim.gather(seed=42)
+        self.assertEqual(paired.simulators[0].maxima, sim.maxima)
+
+        maxima, duration = paired.differences[0]
+        self.assertEqual(maxima.count, 40)
+        self.assertAlmostEqual(maxima.mean, paired.simulators[1].get_average(paired.simulators[1].maxima) -
+                               sim.get_average(sim.maxima))
+        # both players bet black on every spin, so their results move together
+        self.assertTrue(paired.variance_reduction(1, 0) > 1)
+
+        workers = PairedSimulator(game, [Martingale(table=game.table, stake=100, rounds_to_go=250),
+                                         Passenger57(table=game.table, stake=100, rounds_to_go=250)])
+        workers.samples = 40
+        workers.gather(workers=2, seed=42)
+        self.assertEqual(workers.simulators[1].duration, paired.simulators[1].duration)
+
+class TableSimulatorTestCase(unittest.TestCase):
+
+    def make_game(self, limit=100):
+        wheel = Wheel()
+        BinBuilder().build_bins(wheel)
+        return RouletteGame(wheel, Table(limit=limit))
+
+    def test_one_seat(self):
+        # a table of one plays the sessions Simulator plays with the same seed
+        game = self.make_game()
+        crowd = TableSimulator(game, [Martingale(table=game.table, stake=100, rounds_to_go=250)])
+        crowd.samples = 20
+        crowd.gather(seed=42)
+        sim = Simulator(game, Martingale(table=game.table, stake=100, rounds_to_go=250))
+        sim.samples = 20
+        sim.gather(seed=42)
+        self.assertEqual(crowd.simulators["Martingale"].maxima, sim.maxima)
+        self.assertEqual(crowd.simulators["Martingale"].duration, sim.duration)
+
+    def test_limit(self):
+        # the table limit takes only the first seat's bet, the second never plays
+        game = self.make_game(limit=1)
+        game.wheel.seed(1)
+        first = Passenger57(table=game.table, stake=100, rounds_to_go=30)
+        second = Passenger57(table=game.table, stake=100, rounds_to_go=30)
+        crowd = TableSimulator(game, [first, second])
+        crowd.init_duration = 30
+        results = crowd.session_summary()
+        self.assertEqual(results[1], (30, 100, 100))
+        self.assertNotEqual(first.stake, 100)
+        self.assertEqual(game.table.rejected, 30)
+
+    def test_workers(self):
+        game = self.make_game()
+        players = [Martingale(table=game.table, stake=100, rounds_to_go=250),
+                   SevenReds(table=game.table, stake=100, rounds_to_go=250),
+                   Martingale(table=game.table, stake=100, rounds_to_go=250)]
+        one = TableSimulator(game, players)
+        one.samples = 10
+        one.gather(seed=7)
+        self.assertEqual(len(one.simulators["Martingale"].maxima), 20)
+        two = TableSimulator(game, players)
+        two.samples = 10
+        two.gather(workers=2, seed=7)
+        self.assertEqual(two.simulators["SevenReds"].maxima, one.simulators["SevenReds"].maxima)
+        self.assertEqual(two.simulators["Martingale"].duration, one.simulators["Martingale"].duration)
+
+class ResultCacheTestCase(SimulatorTestCase):
+
+    def test_cache(self):
+        played = []
+        cache = ResultCache(self.directory)
+        small = self.make_simulator(cache=cache, samples=10)
+        gather_seeded = small.gather_seeded
+        small.gather_seeded = lambda workers, seeds: played.append(len(seeds)) or gather_seeded(workers, seeds)
+        small.gather(seed=42)
+        small.gather(seed=42)
+        self.assertEqual(played, [10])
+
+        # a bigger run plays only the sessions that are missing, from a cold memory cache
+        big = self.make_simulator(cache=ResultCache(self.directory), samples=25)
+        gather_seeded = big.gather_seeded
+        big.gather_seeded = lambda workers, seeds: played.append(len(seeds)) or gather_seeded(workers, seeds)
+        big.gather(seed=42)
+        self.assertEqual(played, [10, 15])
+
+        plain = self.make_simulator(samples=25)
+        plain.gather(seed=42)
+        self.assertEqual(big.maxima, plain.maxima)
+        self.assertEqual(big.maxima[:10], small.maxima[:10])
+        self.assertEqual(small.maxima[10:], small.maxima[:10]) # gather adds to the lists
+
+        # other seeds and other table limits are other runs
+        self.assertNotEqual(big.cache_key(42), big.cache_key(43))
+        big.game.table.limit = 50
+        self.assertNotEqual(big.cache_key(42), small.cache_key(42))
+
+    def test_capacity(self):
+        cache = ResultCache(capacity=2)
+        for key in "abc":
+            cache.put(key, [(1, 2, 3)])
+        self.assertEqual(cache.memory.keys(), ["b", "c"])
+        self.assertEqual(cache.get("a"), [])
+
+class CheckpointTestCase(SimulatorTestCase):
+    seed = 7
+
+    def setUp(self):
+        SimulatorTestCase.setUp(self)
+        self.path = os.path.join(self.directory, "checkpoint")
+        self.simulator.update(samples=30, checkpoint=self.path, checkpoint_every=10)
+
+    def interrupted(self, sim, after, seed=None):
+        # stops the run by failing the session after AFTER have been recorded
+        record = sim.record
+        def failing(*args):
+            if (sim.maxima_stats.count if sim.streaming else len(sim.maxima)) == after:
+                raise KeyboardInterrupt
+            record(*args)
+        sim.record = failing
+        self.assertRaises(KeyboardInterrupt, sim.gather, seed=seed)
+
+    def test_resume(self):
+        for player_class in (Martingale, SevenReds):
+            plain = self.make_simulator(player_class)
+            plain.checkpoint = None
+            plain.gather()
+
+            self.interrupted(self.make_simulator(player_class), 25)
+            resumed = self.make_simulator(player_class)
+            resumed.game.wheel.seed(99) # the wheel's state comes from the checkpoint
+            resumed.gather(resume=True)
+            self.assertEqual(resumed.maxima, plain.maxima)
+            self.assertEqual(resumed.duration, plain.duration)
+            os.remove(self.path)
+
+    def test_resume_seeded(self):
+        plain = self.make_simulator(streaming=True)
+        plain.checkpoint = None
+        plain.gather(seed=3)
+
+        played = []
+        sim = self.make_simulator(streaming=True)
+        sim.checkpoint_every = 1
+        gather_seeded = sim.gather_seeded
+        sim.gather_seeded = lambda workers, seeds: played.append(len(seeds)) or gather_seeded(workers, seeds)
+        self.interrupted(sim, 12, seed=3)
+        resumed = self.make_simulator(streaming=True)
+        gather_seeded = resumed.gather_seeded
+        resumed.gather_seeded = lambda workers, seeds: played.append(len(seeds)) or gather_seeded(workers, seeds)
+        resumed.gather(resume=True)
+        self.assertEqual(played, [30, 18])
+        self.assertEqual(resumed.seed, 3)
+        self.assertEqual(resumed.maxima_stats.mean, plain.maxima_stats.mean)
+        self.assertEqual(resumed.duration_stats.variance(), plain.duration_stats.variance())
+
+        # a finished run resumes to its report
+        resumed.gather(resume=True)
+        self.assertEqual(played, [30, 18, 0])
+
+        # a checkpoint of another number of samples isn't resumed
+        other = self.make_simulator()
+        other.samples = 20
+        self.assertRaises(ValueError, other.gather, resume=True)
+
+    def test_resume_analysed(self):
+        plain = self.make_simulator(checkpoint=None, analytics=SessionAnalytics(250))
+        plain.gather(seed=3)
+
+        # the sessions come in chunks of 7, so the checkpoints due at 10 and 20 are written at 14 and 21
+        sim = self.make_simulator(analytics=SessionAnalytics(250))
+        self.interrupted(sim, 25, seed=3)
+        resumed = self.make_simulator()
+        resumed.gather(resume=True)
+        self.assertEqual(resumed.maxima, plain.maxima)
+        self.assertEqual(resumed.analytics.duration.count, 30)
+        for name in ("maxima", "duration", "final_stake", "drawdown", "ruin_round"):
+            self.assertEqual(getattr(resumed.analytics, name).counts, getattr(plain.analytics, name).counts)
+        self.assertEqual([ h.counts for h in resumed.analytics.stakes ], [ h.counts for h in plain.analytics.stakes ])
+
+    def test_resume_cached(self):
+        plain = self.make_simulator()
+        plain.checkpoint = None
+        plain.gather(seed=42)
+
+        for warm in (0, 20, 30): # sessions of the run cached before it starts
+            directory = os.path.join(self.directory, "cache%d" % warm)
+            if warm:
+                first = self.make_simulator()
+                first.checkpoint, first.samples, first.cache = None, warm, ResultCache(directory)
+                first.gather(seed=42)
+            sim = self.make_simulator()
+            sim.cache = ResultCache(directory)
+            self.interrupted(sim, 12, seed=42)
+            self.assertTrue(os.path.exists(self.path)) # checkpoints are written while the cache plays
+
+            resumed = self.make_simulator()
+            resumed.cache = ResultCache(directory)
+            resumed.gather(resume=True)
+            self.assertEqual(resumed.maxima, plain.maxima)
+
+            # the cache still holds the run from its first session
+            later = self.make_simulator()
+            later.checkpoint, later.samples, later.cache = None, 10, ResultCache(directory)
+            later.gather(seed=42)
+            self.assertEqual(later.maxima, plain.maxima[:10])
+            os.remove(self.path)
+
+
+class ResultSinkTestCase(SimulatorTestCase):
+
+    def setUp(self):
+        SimulatorTestCase.setUp(self)
+        self.path = os.path.join(self.directory, "results")
+        self.simulator["samples"] = 20
+
+    def test_append(self):
+        sink = ResultSink(self.path, buffer_size=7)
+        self.make_simulator(sink=sink).gather(seed=42)
+        sink.close()
+
+        # reopening carries on after the records already written
+        sink = ResultSink(self.path)
+        self.assertEqual(sink.count, 20)
+        self.make_simulator(sink=sink).gather(seed=43)
+        sink.close()
+        self.assertEqual(ResultSink(self.path).count, 40)
+
+    @unittest.skipIf(roulette.numpy is None, "requires numpy")
+    def test_load(self):
+        sink = ResultSink(self.path, buffer_size=7)
+        sim = self.make_simulator(sink=sink)
+        sim.gather(workers=2, seed=42)
+        sink.flush()
+
+        columns = ResultSink.load(self.path)
+        self.assertEqual(columns["duration"].tolist(), sim.duration)
+        self.assertEqual(columns["maxima"].tolist(), sim.maxima)
+        self.assertEqual(columns["seed"].tolist(), sim.sample_seeds(42))
+        self.assertEqual(set(columns["player"].tolist()), set(["Martingale"]))
+        self.assertEqual(columns["ruined"].tolist(), list( stake == 0 for stake in columns["final_stake"] ))
+        # a session that ends early has lost its stake
+        self.assertEqual(columns["ruined"].tolist(), list( d < 250 for d in sim.duration ))
+        sink.close()
+
+class SimulatorConvergeTestCase(SimulatorTestCase):
+    seed = 4
+
+    def test_converge(self):
+        sim = self.make_simulator()
+        sim.converge(precision=0.1, batch=20)
+        self.assertTrue(sim.converged)
+        self.assertEqual(len(sim.maxima), sim.samples)
+        self.assertEqual(sim.samples % 20, 0)
+        # 95% confidence interval of the duration average within 10%
+        half_width = 1.96 * sim.standard_deviation(sim.duration) / len(sim.duration) ** 0.5
+        self.assertTrue(half_width <= 0.1 * sim.get_average(sim.duration))
+
+    def test_budget(self):
+        sim = self.make_simulator()
+        sim.converge(precision=0.0001, batch=20, max_samples=50)
+        self.assertFalse(sim.converged)
+        self.assertEqual(sim.samples, 50)
+
+    def test_seeded(self):
+        # a seeded run that stops after 40 samples plays the same sessions as a seeded gather of 40
+        sim = self.make_simulator()
+        sim.converge(precision=0.0001, batch=15, max_samples=40, seed=9)
+        other = self.make_simulator()
+        other.samples = 40
+        other.gather(seed=9)
+        self.assertEqual(sim.maxima, other.maxima)
+
 class SimulatorP57Black(GameBlack):
     def test_p57_session(self):
         _p57 = Passenger57(table=self.table, stake=100, rounds_to_go=100)
@@ -317,6 +1117,185 @@ class SevenRedsGameRed(GameRed):
         # 5 wins, 5 loses
         self.assertEqual(_SR.stake, 104)
 
+class MarkovEvaluatorTestCase(unittest.TestCase):
+
+    def make_evaluator(self, player_class, stake, rounds, limit=100):
+        wheel = Wheel(random.Random(5))
+        BinBuilder().build_bins(wheel)
+        self.table = Table(limit=limit)
+        evaluator = MarkovEvaluator(RouletteGame(wheel, self.table),
+                                    player_class(table=self.table, stake=stake, rounds_to_go=rounds))
+        evaluator.init_stake = stake
+        evaluator.init_duration = rounds
+        return evaluator
+
+    def test_passenger57_one_round(self):
+        evaluator = self.make_evaluator(Passenger57, 100, 1).evaluate()
+        self.assertEqual(evaluator.duration.keys(), [1])
+        self.assertAlmostEqual(evaluator.duration[1], 1.0)
+        self.assertAlmostEqual(evaluator.maxima[101], 18 / 38.0)
+        self.assertAlmostEqual(evaluator.maxima[99], 20 / 38.0)
+        self.assertEqual(evaluator.ruin_probability(), 0)
+
+    def test_martingale_two_rounds(self):
+        evaluator = self.make_evaluator(Martingale, 1, 2).evaluate()
+        win, lose = 18 / 38.0, 20 / 38.0
+        self.assertAlmostEqual(evaluator.ruin_probability(), lose) # a win leaves 2, betting 1 can't ruin
+        self.assertAlmostEqual(evaluator.maxima[0], lose)
+        self.assertAlmostEqual(evaluator.maxima[3], win * win)
+        self.assertAlmostEqual(evaluator.maxima[2], win * lose)
+        self.assertAlmostEqual(evaluator.duration[1], lose)
+        self.assertEqual(evaluator.ruin_by_round(), [evaluator.ruin[0], evaluator.ruin_probability()])
+
+    def test_martingale_over_limit(self):
+        # the fourth loss in a row asks for a bet of 8, over the limit, and the player can't bet any more
+        evaluator = self.make_evaluator(Martingale, 100, 10, limit=7).evaluate()
+        self.assertAlmostEqual(sum(evaluator.duration.values()), 1.0)
+        self.assertEqual(evaluator.ruin_probability(), 0)
+        self.assertTrue(evaluator.transition((93, 3, 7)) is None)
+
+    def test_against_simulator(self):
+        evaluator = self.make_evaluator(SevenReds, 20, 60, limit=16).evaluate()
+        sim = Simulator(evaluator.game, evaluator.player)
+        sim.init_stake, sim.init_duration, sim.samples = 20, 60, 400
+        sim.gather(seed=3)
+        self.assertTrue(abs(evaluator.get_average(evaluator.maxima) - sim.get_average(sim.maxima)) < 1)
+        self.assertTrue(abs(evaluator.get_average(evaluator.duration) - sim.get_average(sim.duration)) < 5)
+
+        self.assertRaises(TypeError, lambda: MarkovEvaluator(evaluator.game, object()))
+
+        # a subclass may play its own way, it isn't evaluated as the strategy it extends
+        class Cautious(Martingale):
+            def place_bets(self):
+                pass
+        self.assertRaises(TypeError, lambda: MarkovEvaluator(evaluator.game, Cautious(self.table, 20, 60)))
+
+class ImportanceSimulatorTestCase(unittest.TestCase):
+
+    def test_tilted_random(self):
+        rng = TiltedRandom(3)
+        rng.tilt([3, 1])
+        picks = list( rng.choice("ab") for i in range(4000) )
+        self.assertAlmostEqual(picks.count("a") / 4000.0, 0.75, delta=0.03)
+        self.assertAlmostEqual(rng.likelihood, (2 / 3.0) ** picks.count("a") * 2 ** picks.count("b"))
+
+    def test_martingale_ruin(self):
+        wheel = Wheel()
+        BinBuilder().build_bins(wheel)
+        table = Table(limit=10000)
+        game = RouletteGame(wheel, table)
+
+        exact = MarkovEvaluator(game, Martingale(table=table, stake=1023, rounds_to_go=60))
+        exact.init_stake, exact.init_duration = 1023, 60
+        exact.evaluate()
+
+        # tilt towards losses once a losing streak has started
+        sim = ImportanceSimulator(game, Martingale(table=table, stake=1023, rounds_to_go=60), "Black", 0.25,
+                                  when=lambda player: player.loss_count >= 3)
+        sim.init_stake, sim.init_duration, sim.samples = 1023, 60, 2000
+        sim.gather(seed=1)
+        ruin, error = sim.estimate(sim.ruin)
+        self.assertTrue(abs(ruin - exact.ruin_probability()) < 4 * error)
+        self.assertAlmostEqual(sim.weights.mean, 1.0, delta=0.1)
+        # fewer than half the variance of plain sampling
+        self.assertTrue(error ** 2 < 0.5 * exact.ruin_probability() * (1 - exact.ruin_probability()) / sim.samples)
+        self.assertTrue(isinstance(wheel.rng, random.Random) and not isinstance(wheel.rng, TiltedRandom))
+
+class SkipAheadSimulatorTestCase(unittest.TestCase):
+    """
+    SkipAheadSimulator should agree with Simulator in distribution
+    """
+    def gather(self, simulator_class, player_class, stake, rounds, samples, seed):
+        wheel = Wheel(random.Random(seed))
+        BinBuilder().build_bins(wheel)
+        table = Table(limit=100)
+        sim = simulator_class(RouletteGame(wheel, table), player_class(table=table, stake=stake, rounds_to_go=rounds))
+        sim.init_stake, sim.init_duration, sim.samples, sim.streaming = stake, rounds, samples, True
+        sim.gather()
+        return sim
+
+    def assertAgree(self, player_class, stake, rounds, samples):
+        plain = self.gather(Simulator, player_class, stake, rounds, samples, 1)
+        skip = self.gather(SkipAheadSimulator, player_class, stake, rounds, samples, 2)
+        for a, b in ((plain.maxima_stats, skip.maxima_stats), (plain.duration_stats, skip.duration_stats)):
+            # 5 standard errors of the difference
+            error = math.sqrt((a.variance() + b.variance()) / samples)
+            self.assertTrue(abs(a.mean - b.mean) <= 5 * error + 1e-9, (player_class, a.mean, b.mean))
+
+    def test_agree(self):
+        self.assertAgree(Martingale, 100, 250, 1000)
+        self.assertAgree(Passenger57, 20, 500, 1000)
+        self.assertAgree(SevenReds, 20, 2000, 300)
+
+    def test_fallback(self):
+        class FlatRed(Passenger57):
+            pass
+
+        # players without an engine of their own are played spin by spin
+        sim = self.gather(SkipAheadSimulator, FlatRed, 100, 50, 10, 3)
+        self.assertEqual(sim.duration_stats.mean, 50)
+
+class BatchSimulatorTestCase(unittest.TestCase):
+    """
+    BatchSimulator should agree with Simulator for the same strategy parameters
+    """
+    def make_game(self, seed):
+        wheel = Wheel(random.Random(seed))
+        BinBuilder().build_bins(wheel)
+        self.table = Table(limit=100)
+        return RouletteGame(wheel, self.table)
+
+    def test_martingale(self):
+        game = self.make_game(1)
+        sim = Simulator(game, Martingale(table=self.table, stake=100, rounds_to_go=250))
+        sim.samples = 400
+        sim.gather()
+
+        game = self.make_game(1)
+        batch = BatchSimulator(game, Martingale(table=self.table, stake=100, rounds_to_go=250), seed=1)
+        batch.samples = 4000
+        batch.gather()
+
+        self.assertEqual(len(batch.duration), 4000)
+        self.assertTrue(max(batch.duration) <= 250)
+        # 5 standard errors of the difference
+        self.assertTrue(abs(sim.get_average(sim.duration) - batch.get_average(batch.duration)) < 25)
+        self.assertTrue(abs(sim.get_average(sim.maxima) - batch.get_average(batch.maxima)) < 12)
+
+    def test_sevenreds_and_passenger57(self):
+        for player_class in (SevenReds, Passenger57):
+            batch = BatchSimulator(self.make_game(2), player_class(table=self.table, stake=100, rounds_to_go=250))
+            batch.samples = 1000
+            batch.gather()
+            self.assertEqual(batch.duration, list( 250 for d in range(1000)))
+            self.assertTrue(batch.get_average(batch.maxima) > 100)
+
+    def test_strategy_machine(self):
+        class RedMachine(StrategyMachine):
+            outcome = "Red"
+
+        class FlatRed(Passenger57):
+            def machine(self):
+                return RedMachine()
+
+        batch = BatchSimulator(self.make_game(4), FlatRed(table=self.table, stake=100, rounds_to_go=250), seed=4)
+        batch.samples = 1000
+        batch.gather()
+        self.assertEqual(batch.duration, list( 250 for d in range(1000)))
+        self.assertTrue(batch.get_average(batch.maxima) > 100)
+
+    def test_unsupported_player(self):
+        game = self.make_game(3)
+        self.assertRaises(TypeError, lambda: BatchSimulator(game, object()))
+
+        # nor is a subclass that inherits its strategy's machine but may not play it
+        class Cautious(Martingale):
+            def place_bets(self):
+                pass
+        player = Cautious(table=self.table, stake=100, rounds_to_go=250)
+        self.assertRaises(TypeError, lambda: BatchSimulator(game, player))
+
+
 if __name__ == '__main__':
     logging.basicConfig( stream=sys.stderr )
     logging.getLogger( "GameTestCase.test_game" ).setLevel( logging.DEBUG )
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+__author__ = 'mattmckay'
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib2
+
+from roulette import BinBuilder, Martingale, ResultCache, RouletteGame, Simulator, Table, Wheel
+from service import ServiceHandler, ServiceServer, SimulationService
+
+
+class SimulationServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.service = SimulationService(workers=2)
+        self.server = ServiceServer(('127.0.0.1', 0), self.service)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/jobs' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.service.close()
+
+    def post(self, request):
+        return json.load(urllib2.urlopen(urllib2.Request(self.url, json.dumps(request),
+                                                         {'Content-Type': 'application/json'})))
+
+    def wait(self, id):
+        for i in range(200):
+            job = json.load(urllib2.urlopen('%s/%s' % (self.url, id)))
+            if job['status'] in ('done', 'failed'):
+                return job
+            time.sleep(0.05)
+        self.fail("job %s didn't finish" % id)
+
+    def test_job(self):
+        job = self.post({'player': 'martingale', 'samples': 20, 'seed': 42})
+        self.assertTrue(job['status'] in ('queued', 'running', 'done'))
+        job = self.wait(job['id'])
+        self.assertEqual(job['completed'], 20)
+
+        # the same sessions as a seeded gather
+        wheel = Wheel()
+        BinBuilder().build_bins(wheel)
+        table = Table(limit=100)
+        sim = Simulator(RouletteGame(wheel, table), Martingale(table=table, stake=100, rounds_to_go=250))
+        sim.samples = 20
+        stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+        try:
+            sim.gather(seed=42)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        self.assertAlmostEqual(job['maxima']['average'], sim.get_average(sim.maxima))
+        self.assertAlmostEqual(job['duration']['standard_deviation'], sim.standard_deviation(sim.duration))
+
+        self.assertEqual(list( j['id'] for j in json.load(urllib2.urlopen(self.url)) ), [job['id']])
+
+    def test_stream(self):
+        job = self.post({'player': 'passenger57', 'samples': 40, 'rounds': 50, 'seed': 1})
+        lines = list( json.loads(line) for line in urllib2.urlopen('%s/%s/stream' % (self.url, job['id'])) )
+        self.assertEqual(lines[-1]['status'], 'done')
+        self.assertEqual(lines[-1]['completed'], 40)
+        completed = list( line['completed'] for line in lines )
+        self.assertEqual(completed, sorted(completed))
+
+    def test_slow_stream(self):
+        # a streaming client that stops reading doesn't stop the jobs
+        stalled, release = threading.Event(), threading.Event()
+        write_chunk = ServiceHandler.write_chunk
+        def stalling(handler, data):
+            stalled.set()
+            release.wait(10)
+            write_chunk(handler, data)
+        ServiceHandler.write_chunk = stalling
+        try:
+            job = self.post({'player': 'martingale', 'samples': 200, 'seed': 2})
+            stream = threading.Thread(target=lambda: urllib2.urlopen('%s/%s/stream' % (self.url, job['id'])).read())
+            stream.daemon = True
+            stream.start()
+            self.assertTrue(stalled.wait(10))
+            ServiceHandler.write_chunk = write_chunk
+            for i in range(100):
+                if self.service.jobs[job['id']].finished():
+                    break
+                time.sleep(0.05)
+            self.assertEqual(self.service.jobs[job['id']].status, 'done')
+        finally:
+            ServiceHandler.write_chunk = write_chunk
+            release.set()
+
+    def test_cache(self):
+        plain = self.wait(self.post({'player': 'martingale', 'samples': 30, 'seed': 5})['id'])
+
+        self.service.cache = ResultCache()
+        self.wait(self.post({'player': 'martingale', 'samples': 10, 'seed': 5})['id'])
+        cached = self.wait(self.post({'player': 'martingale', 'samples': 30, 'seed': 5,
+                                      'parameters': {'base_wager': 1}})['id'])
+        self.assertEqual(cached['maxima'], plain['maxima'])
+        self.assertEqual(len(self.service.cache.memory.values()[0]), 30)
+
+    def test_bad_request(self):
+        try:
+            self.post({'player': 'nobody'})
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 400)
+        else:
+            self.fail("unknown strategy accepted")
+
+    def test_layout(self):
+        # a job names a layout the service has loaded, never a file of its own
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "coin.json")
+        with open(path, "w") as f:
+            json.dump({"name": "coin", "size": 2, "outcomes": [["Black", 1, [0]], ["Red", 1, [1]]]}, f)
+        try:
+            self.post({'player': 'martingale', 'layout': path})
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 400)
+        else:
+            self.fail("layout path accepted")
+
+        service = SimulationService(layouts={'coin': path})
+        try:
+            job = service.submit({'player': 'martingale', 'samples': 5, 'seed': 1, 'layout': 'coin'})
+            for i in range(200):
+                if job.finished():
+                    break
+                time.sleep(0.05)
+            self.assertEqual(job.status, 'done')
+            self.assertEqual(job.maxima.count, 5)
+        finally:
+            service.close()
+
+if __name__ == '__main__':
+    unittest.main()
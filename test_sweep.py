@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+__author__ = 'mattmckay'
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from roulette import Martingale, Passenger57, SevenReds
+from sweep import Sweep, parse_range
+
+
+class ParseRangeTestCase(unittest.TestCase):
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range("100:300:100"), [100, 200, 300])
+        self.assertEqual(parse_range("1:3"), [1, 2, 3])
+        self.assertEqual(parse_range("1,2,4"), [1, 2, 4])
+
+
+class SweepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.directory, "sweep.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_sweep(self, checkpoint=None):
+        return Sweep(Martingale, [50, 100], [100], [40], [1, 2], samples=5, seed=3, checkpoint=checkpoint)
+
+    def test_run(self):
+        rows = self.make_sweep().run()
+        self.assertEqual(list( (r['stake'], r['base_wager']) for r in rows ), [(50, 1), (50, 2), (100, 1), (100, 2)])
+        self.assertTrue(all( r['duration_average'] <= 40 for r in rows ))
+
+        # the same cells give the same results on any number of workers
+        self.assertEqual(self.make_sweep().run(workers=2), rows)
+
+    def test_resume(self):
+        rows = self.make_sweep(self.checkpoint).run()
+
+        # drop the last two cells from the checkpoint, as if the sweep had been interrupted
+        with open(self.checkpoint) as f:
+            lines = f.readlines()
+        with open(self.checkpoint, "w") as f:
+            f.writelines(lines[:3])
+
+        sweep = self.make_sweep(self.checkpoint)
+        self.assertEqual(len(sweep.completed()), 2)
+        self.assertEqual(sweep.run(), rows)
+        self.assertEqual(len(sweep.completed()), 4)
+
+        # another seed, number of samples, layout or player doesn't reuse the rows
+        for other in (Sweep(Martingale, [50, 100], [100], [40], [1, 2], samples=5, seed=4, checkpoint=self.checkpoint),
+                      Sweep(Martingale, [50, 100], [100], [40], [1, 2], samples=6, seed=3, checkpoint=self.checkpoint),
+                      Sweep(Martingale, [50, 100], [100], [40], [1, 2], samples=5, seed=3, layout='european',
+                            checkpoint=self.checkpoint),
+                      Sweep(SevenReds, [50, 100], [100], [40], [1], samples=5, seed=3, checkpoint=self.checkpoint)):
+            self.assertRaises(ValueError, other.run)
+
+    def test_truncated(self):
+        rows = self.make_sweep(self.checkpoint).run()
+
+        # cut the third cell's line off halfway, as a crash while it was written would
+        with open(self.checkpoint) as f:
+            lines = f.readlines()
+        with open(self.checkpoint, "w") as f:
+            f.writelines(lines[:3] + [lines[3][:len(lines[3]) // 2]])
+
+        sweep = self.make_sweep(self.checkpoint)
+        self.assertEqual(len(sweep.completed()), 2)
+        self.assertEqual(sweep.run(), rows)
+        with open(self.checkpoint) as f:
+            self.assertEqual(len(f.readlines()), 5) # the unfinished line is replaced, not appended to
+        self.assertEqual(len(sweep.completed()), 4)
+
+    def test_write(self):
+        sweep = Sweep(Passenger57, [100], [100], [10], [1, 2], samples=3)
+        rows = sweep.run()
+        self.assertEqual(len(rows), 1) # base wager doesn't apply to Passenger57
+        path = os.path.join(self.directory, "sweep.csv")
+        sweep.write(path, rows)
+        with open(path) as f:
+            written = list(csv.DictReader(f))
+        self.assertEqual(written[0]['player'], 'Passenger57')
+        self.assertEqual(written[0]['duration_average'], '10.0')
+
+if __name__ == '__main__':
+    unittest.main()